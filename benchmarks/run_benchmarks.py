@@ -0,0 +1,256 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+"""
+Benchmarks of the capacity studies: headroom, max_cap, simple_contingency_test and run_timeseries
+on the Svedala grid in tutorials/data and on pandapower test networks of increasing size.
+
+Wall time, number of power flows, Newton iterations and peak memory of every case are written
+to a json report together with the git commit, so that runs on different commits can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import random
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from time import perf_counter
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pandapower as pp
+import pandapower.networks as pn
+from pandapower.control import ConstControl
+from pandapower.timeseries import DFData, OutputWriter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from capacitymap.grid.grid import Grid
+from capacitymap.analysis import analysis_check, capacity_analysis, contingency, timeseries
+
+SVEDALA_DIR = os.path.join(REPO_DIR, 'tutorials', 'data', 'svedala')
+
+# Limits of the tutorials
+NORMAL_LIMITS = {'vmin': 0.9, 'vmax': 1.12, 'max_line_loading': 105, 'max_trafo_loading': 100,
+                 'subscription_p_limits': 1000, 'run_controllers': True}
+CONT_LIMITS = {'vmin': 0.87, 'vmax': 1.15, 'max_line_loading': 120, 'max_trafo_loading': 120,
+               'subscription_p_limits': 1000, 'run_controllers': True}
+
+CASES = ['headroom', 'max_cap', 'contingency', 'timeseries']
+
+
+def load_svedala():
+    net = pp.from_json(os.path.join(SVEDALA_DIR, 'svedala.json'))
+    with open(os.path.join(SVEDALA_DIR, 'line_to_test.json')) as f:
+        lines_to_test = json.load(f)
+    with open(os.path.join(SVEDALA_DIR, 'trafo_to_test.json')) as f:
+        trafos_to_test = json.load(f)
+    return net, [lines_to_test, trafos_to_test]
+
+
+def _test_network(create, n_contingencies=10):
+    """
+    Loader of a test network with up to n_contingencies line and trafo outages that do not island any bus,
+    so that every outage of the scenario is checked with a power flow. Radial nets have none.
+    """
+    def load():
+        net = create()
+        scenario = []
+        for element in ('line', 'trafo'):
+            outages = [(element, i) for i in net[element].index[net[element].in_service]]
+            islanded = contingency.islanded_buses(net, outages)
+            scenario.append([i for (_, i), cut in zip(outages, islanded) if not len(cut)][:n_contingencies])
+        return net, scenario
+    return load
+
+
+# Networks of the benchmark, from small to large
+NETWORKS = {'svedala': load_svedala,
+            'cigre_mv': _test_network(lambda: pn.create_cigre_network_mv(with_der=False)),
+            'case33bw': _test_network(pn.case33bw),
+            'mv_oberrhein': _test_network(pn.mv_oberrhein),
+            'case300': _test_network(pn.case300)}
+
+
+def git_commit():
+    """
+    Commit of the benchmarked tree, with a '+dirty' suffix if there are uncommitted changes
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+dirty' if dirty.strip() else '')
+
+
+def sample_buses(net, n_buses):
+    """
+    n_buses buses in service spread evenly over net.bus, all buses if n_buses is None
+    """
+    buses = net.bus.index[net.bus.in_service]
+    if n_buses is None or n_buses >= len(buses):
+        return list(buses)
+    return list(buses[np.linspace(0, len(buses) - 1, n_buses).astype(int)])
+
+
+def run_headroom(net, contingency_scenario, args):
+    buses = sample_buses(net, args.buses)
+    capacity_analysis.headroom(net, args.loadorgen, args.upper_lim_p, normal_limits=NORMAL_LIMITS,
+                               contingency_limits=CONT_LIMITS, contingency_scenario=contingency_scenario,
+                               workers=args.workers, method=args.method, buses=buses, progress=None)
+    return {'buses': len(buses)}
+
+
+def run_max_cap(net, contingency_scenario, args):
+    bus = sample_buses(net, 1)[0]
+    loadorgen = 'load' if args.loadorgen == 'both' else args.loadorgen
+    head = capacity_analysis.max_cap(net, bus, loadorgen, args.upper_lim_p, capacity_analysis.LOW_LIM_P,
+                                     capacity_analysis.Q_MVAR, capacity_analysis.S_TOL, NORMAL_LIMITS, CONT_LIMITS,
+                                     contingency_scenario, method=args.method)
+    return {'bus': int(bus), 'headroom': head}
+
+
+def run_contingency(net, contingency_scenario, args):
+    pp.runpp(net)
+    ok, scenarios = analysis_check.simple_contingency_test(
+        net, run_control=CONT_LIMITS['run_controllers'], vmax=CONT_LIMITS['vmax'], vmin=CONT_LIMITS['vmin'],
+        max_line_loading=CONT_LIMITS['max_line_loading'], max_trafo_loading=CONT_LIMITS['max_trafo_loading'],
+        p_lim=CONT_LIMITS['subscription_p_limits'], contingency_scenario=contingency_scenario)
+    return {'scenarios': scenarios, 'feasible': bool(ok)}
+
+
+def run_timeseries(net, contingency_scenario, args):
+    """
+    Daily load profiles drawn with a fixed seed, controlled by ConstControl as in the timeseries tutorial
+    """
+    rng = random.Random(0)
+    start = datetime(2021, 9, 1)
+    datetime_steps = [start + timedelta(days=i) for i in range(args.time_steps)]
+    time_steps = range(len(datetime_steps))
+    profiles = pd.DataFrame({idx: [p * rng.uniform(0, 1.2) for _ in time_steps] for idx, p in net.load.p_mw.items()},
+                            index=time_steps)
+    ds = DFData(profiles)
+    for idx in net.load.index:
+        ConstControl(net, element='load', variable='p_mw', element_index=[idx], data_source=ds, profile_name=idx)
+    ow = OutputWriter(net, time_steps, output_path=tempfile.mkdtemp(), output_file_type='.json', log_variables=list())
+    ow.log_variable('res_bus', 'vm_pu')
+
+    stats = {'counter': 0, 'power_flows': 0, 'iterations': 0}
+
+    def runpp(net, **kwargs):
+        # counts the power flows of the time series, named runpp to keep the recycle options of pp.runpp
+        stats['counter'] += 1
+        stats['power_flows'] += 1
+        try:
+            pp.runpp(net, **kwargs)
+        finally:
+            stats['iterations'] += analysis_check._pf_iterations(net)
+
+    grid = Grid('benchmark', net, {}, pd.DataFrame(columns=['Start', 'End', 'Object_type', 'ObjectID', 'Status']))
+    timeseries.run_timeseries(grid, time_steps, datetime_steps, continue_on_divergence=True, verbose=False, run=runpp)
+    analysis_check.add_counters(stats)
+    return {'time_steps': len(time_steps)}
+
+
+RUNNERS = {'headroom': run_headroom, 'max_cap': run_max_cap, 'contingency': run_contingency, 'timeseries': run_timeseries}
+
+
+def measure(case, network, args):
+    """
+    Runs a case on a fresh copy of the network args.repeat times for the wall time, and once more
+    under tracemalloc for the peak memory.
+
+    OUTPUT
+        result (dict) - min and median wall time (s), power flows and Newton iterations of one run,
+                        peak memory (MB) and the details returned by the case
+    """
+    base_net, contingency_scenario = NETWORKS[network]()
+    times = []
+    for _ in range(args.repeat):
+        net = base_net.deepcopy()
+        analysis_check.reset_counters()
+        start = perf_counter()
+        details = RUNNERS[case](net, contingency_scenario, args)
+        times.append(perf_counter() - start)
+        counters = analysis_check.get_counters()
+
+    net = base_net.deepcopy()
+    tracemalloc.start()
+    try:
+        RUNNERS[case](net, contingency_scenario, args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'case': case, 'network': network, 'buses': len(base_net.bus),
+            'wall_time_min_s': min(times), 'wall_time_median_s': float(np.median(times)),
+            'power_flows': counters['power_flows'], 'checks': counters['counter'], 'newton_iterations': counters['iterations'],
+            'warm_starts': counters.get('warm_starts', 0), 'warm_start_fallbacks': counters.get('warm_start_fallbacks', 0),
+            'solver': counters.get('solver', {}),
+            'peak_memory_mb': peak / 1e6, 'details': details}
+
+
+def compare(report, previous):
+    """
+    Prints the change of wall time and power flows of every case against a previous report
+    """
+    before = {(r['case'], r['network']): r for r in previous['results']}
+    print('Compared to %s' % previous.get('commit'))
+    print('%-12s %-14s %12s %12s %12s' % ('case', 'network', 'time ratio', 'PF ratio', 'mem ratio'))
+    for r in report['results']:
+        old = before.get((r['case'], r['network']))
+        if old is None:
+            continue
+        ratio = lambda new, prev: new / prev if prev else float('nan')
+        print('%-12s %-14s %12.3f %12.3f %12.3f' % (r['case'], r['network'],
+                                                    ratio(r['wall_time_min_s'], old['wall_time_min_s']),
+                                                    ratio(r['power_flows'], old['power_flows']),
+                                                    ratio(r['peak_memory_mb'], old['peak_memory_mb'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='benchmark.json', help='Json report to write')
+    parser.add_argument('--compare', help='Previous json report to compare with')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--networks', nargs='+', choices=list(NETWORKS), default=list(NETWORKS))
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, the min and median are reported')
+    parser.add_argument('--buses', type=int, default=20, help='Buses searched by the headroom case, 0 for all buses')
+    parser.add_argument('--loadorgen', default='load', choices=['load', 'sgen', 'both'])
+    parser.add_argument('--upper-lim-p', dest='upper_lim_p', type=float, default=500.)
+    parser.add_argument('--method', default='bisection')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--time-steps', dest='time_steps', type=int, default=24)
+    args = parser.parse_args(argv)
+    if args.buses == 0:
+        args.buses = None
+
+    report = {'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'pandapower': pp.__version__, 'machine': platform.platform(),
+              'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}, 'results': []}
+    for network in args.networks:
+        for case in args.cases:
+            print('%s on %s' % (case, network))
+            report['results'].append(measure(case, network, args))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print('Report written to %s' % args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,11 +6,336 @@
 This file contains the function used to analyse the network. Rely heavily on powerflows.
 """
 
+from collections.abc import Sequence
+from contextlib import redirect_stdout
+from io import StringIO
+import numpy as np
+import pandas as pd
 import pandapower as pp
+from pandapower.control.run_control import ControllerNotConverged
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from capacitymap.analysis import contingency
 from capacitymap.controllers.controller_functions import reset_all_controllers
 
+# Names of the checks returned by check_violations, in order
+VIOLATIONS = ('upper_voltage', 'lower_voltage', 'line_loading', 'trafo_loading', 'ext_limit', 'unsupplied', 'not_converged')
 
-def check_violations(net, run_control = False, vmax=1.1, vmin=0.9, max_line_loading=100., max_trafo_loading=100., p_lim=1000.):
+# Power flow statistics kept as attributes on check_violations
+_COUNTERS = ('counter', 'power_flows', 'iterations', 'warm_starts', 'warm_start_fallbacks')
+
+
+def reset_counters():
+    '''
+    Resets the power flow statistics of check_violations:
+    counter : number of checked power flows
+    power_flows : runs of pp.runpp, a check that is retried on the solver ladder counts every rung it tries
+    iterations : Newton iterations of the checked power flows
+    warm_starts : power flows started from the previous results
+    warm_start_fallbacks : warm started power flows that diverged and were rerun from a flat start
+    solver : dict of the solver ladder, tried and converged power flows per rung ('<rung>_tried', '<rung>_converged'),
+             failed power flows per class of exception ('exception_<class>', see classify_exception) and
+             checks that failed on every rung ('collapsed')
+    The collapsed checks counted by the solver ladder are reset as well.
+    '''
+    for name in _COUNTERS:
+        setattr(check_violations, name, 0)
+    check_violations.solver = {}
+    solver_ladder.reset()
+
+
+def get_counters():
+    '''
+    Returns the power flow statistics of check_violations as a dict
+    '''
+    counters = {name: getattr(check_violations, name) for name in _COUNTERS}
+    counters['solver'] = dict(check_violations.solver)
+    return counters
+
+
+def add_counters(counters):
+    '''
+    Adds power flow statistics from get_counters, e.g. collected in another process, to check_violations
+    '''
+    for name in _COUNTERS:
+        setattr(check_violations, name, getattr(check_violations, name) + counters.get(name, 0))
+    for name, value in counters.get('solver', {}).items():
+        _count(name, value)
+
+
+def _count(name, value=1):
+    check_violations.solver[name] = check_violations.solver.get(name, 0) + value
+
+
+def violation_names(violations):
+    '''
+    Returns the names of the broken limits of a check_violations result
+    '''
+    return [name for name, violated in zip(VIOLATIONS, violations) if violated]
+
+
+def get_pf_state(net):
+    '''
+    Returns a copy of the bus voltages of the last power flow, to be used as start values for a later power flow
+    '''
+    return net.res_bus[['vm_pu', 'va_degree']].copy()
+
+
+def set_pf_state(net, state):
+    '''
+    Writes bus voltages from get_pf_state to net.res_bus, a power flow with init="results" starts from them
+    '''
+    net.res_bus['vm_pu'] = state['vm_pu']
+    net.res_bus['va_degree'] = state['va_degree']
+
+
+def _pf_iterations(net):
+    try:
+        return int(net._ppc['iterations'])
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def _clear_pf_iterations(net):
+    # a power flow that fails before Newton-Raphson leaves no iterations, not those of the previous power flow
+    ppc = net.get('_ppc')
+    if isinstance(ppc, dict):
+        ppc.pop('iterations', None)
+
+
+# Classes of power flow exceptions that are retried on the next rung of the solver ladder
+RETRIED = ('not_converged', 'controller_not_converged', 'numerical')
+
+# Rungs of the default solver ladder after the first power flow, name and options of pp.runpp
+LADDER_RUNGS = (('flat', {'init': 'auto'}),
+                ('iwamoto', {'init': 'auto', 'algorithm': 'iwamoto_nr'}),
+                ('iterations', {'init': 'auto', 'max_iteration': 50}))
+
+
+def classify_exception(error):
+    '''
+    Class of an exception of pp.runpp: 'not_converged', 'controller_not_converged', 'numerical' (singular or
+    non-finite matrices) or 'error' for anything else, e.g. an invalid net, which is not retried
+    '''
+    if isinstance(error, ControllerNotConverged):
+        return 'controller_not_converged'
+    if isinstance(error, pp.LoadflowNotConverged):
+        return 'not_converged'
+    if isinstance(error, (np.linalg.LinAlgError, FloatingPointError, ZeroDivisionError)):
+        return 'numerical'
+    return 'error'
+
+
+class SolverLadder:
+    '''
+    Power flow settings that check_violations tries one after the other until a power flow converges.
+    The first power flow uses the requested init, 'warm' for init="results" and 'start' otherwise,
+    rungs with the same options as the first power flow are skipped. While retry is False, e.g. for a probe that the
+    capacity search already knows to be infeasible, checks only get the first power flow.
+
+    INPUT
+        rungs (tuple) - (name, options of pp.runpp) per rung after the first power flow, see LADDER_RUNGS
+        collapse_budget (int) - Number of checks in a row that may fail on every rung. Once it is used up the
+                                following checks only get the first rung after a warm start, until a check converges
+                                again, so that a collapsed case is not retried over and over.
+    '''
+
+    def __init__(self, rungs=LADDER_RUNGS, collapse_budget=3):
+        self.rungs = tuple(rungs)
+        self.collapse_budget = collapse_budget
+        self.collapsed = 0
+        self.retry = True
+
+    def reset(self):
+        '''
+        Restores the collapse budget, e.g. before the search of the next bus
+        '''
+        self.collapsed = 0
+
+    def attempts(self, init):
+        '''
+        (name, options) of the power flows to try for a check with init
+        '''
+        first = ('warm' if init == "results" else 'start', {'init': init})
+        if not self.retry:
+            return [first]
+        rungs = [rung for rung in self.rungs if rung[1] != first[1]]
+        if self.collapsed >= self.collapse_budget:
+            rungs = rungs[:1] if init == "results" else []
+        return [first] + rungs
+
+
+# Solver ladder of check_violations, replace it to change the rungs or the budget
+solver_ladder = SolverLadder()
+
+
+def _runpp(net, run_control, init):
+    '''
+    Runs the power flow on the rungs of solver_ladder until one converges and raises the exception of the
+    last power flow if none does. Exceptions that are not retried (see classify_exception) stop the ladder.
+    '''
+    error = None
+    for rung, options in solver_ladder.attempts(init):
+        _count(rung + '_tried')
+        check_violations.power_flows += 1
+        if rung == 'warm':
+            check_violations.warm_starts += 1
+        _clear_pf_iterations(net)
+        try:
+            if options.get('algorithm') == 'iwamoto_nr':
+                # pandapower prints the Iwamoto multiplier of every iteration
+                with redirect_stdout(StringIO()):
+                    pp.runpp(net, run_control=run_control, **options)
+            else:
+                pp.runpp(net, run_control=run_control, **options)
+        except Exception as e:
+            # the iterations of failed rungs count as well
+            check_violations.iterations += _pf_iterations(net)
+            error = e
+            error_class = classify_exception(e)
+            _count('exception_' + error_class)
+            if rung == 'warm':
+                check_violations.warm_start_fallbacks += 1
+            if error_class not in RETRIED:
+                raise
+            continue
+        check_violations.iterations += _pf_iterations(net)
+        _count(rung + '_converged')
+        solver_ladder.collapsed = 0
+        return
+    solver_ladder.collapsed += 1
+    _count('collapsed')
+    raise error
+
+
+class ViolationExplanation(Sequence):
+    '''
+    violation_exp of check_violations, built from the masks of the broken limits on first access so that
+    checks whose explanation is never read do not pay for the names
+    '''
+
+    def __init__(self, net, upper, lower, line, trafo, ext, load_buses, unsupplied):
+        self._net = net
+        self._masks = (upper, lower, line, trafo, ext, load_buses, unsupplied)
+        self._index = (net.bus.index, net.line.index, net.trafo.index)
+        self._exp = None
+
+    def _build(self):
+        if self._exp is None:
+            net = self._net
+            upper, lower, line, trafo, ext, load_buses, unsupplied = self._masks
+            exp = [None] * 7
+            if upper.any():
+                exp[0] = [x for x in net.bus.name.values[upper]]
+            if lower.any():
+                exp[1] = [x for x in net.bus.name.values[lower]]
+            if line.any():
+                exp[2] = [x for x in net.line.index[line]]
+            if trafo.any():
+                exp[3] = [x.replace("'",'').replace(' ','') for x in net.trafo.name.values[trafo]]
+            if ext:
+                exp[4] = 'Ext grid subscription overloaded'
+            if unsupplied.any():
+                exp[5] = [x for x in net.bus.name.loc[load_buses[unsupplied]]]
+            self._exp = exp
+            self._net = None
+        return self._exp
+
+    def __getitem__(self, i):
+        return self._build()[i]
+
+    def __len__(self):
+        return 7
+
+    def elements(self):
+        '''
+        Indices of the violated elements as {'bus': [...], 'line': [...], 'trafo': [...]}, the buses with a voltage
+        violation and the unsupplied load buses
+        '''
+        upper, lower, line, trafo, ext, load_buses, unsupplied = self._masks
+        bus_index, line_index, trafo_index = self._index
+        return {'bus': list(bus_index[upper | lower]) + list(load_buses[unsupplied]),
+                'line': list(line_index[line]), 'trafo': list(trafo_index[trafo])}
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(self._build())
+
+
+def violated_elements(violation_exp):
+    '''
+    Indices of the violated elements of a violation_exp of check_violations, see ViolationExplanation.elements.
+    Empty if the power flow did not converge or the violations were not explained, e.g. screened outages
+    '''
+    if isinstance(violation_exp, ViolationExplanation):
+        return violation_exp.elements()
+    return {'bus': [], 'line': [], 'trafo': []}
+
+
+class ViolationCheck:
+    '''
+    Limit check of check_violations compiled for one net and one set of limits. The positions of the load buses
+    are kept between checks and the limits are compared on the result arrays, see check_violations for the limits.
+    Use valid(net) to find out if the check can be used for a net.
+    '''
+
+    def __init__(self, net, vmax=1.1, vmin=0.9, max_line_loading=100., max_trafo_loading=100., p_lim=1000.):
+        self.vmax, self.vmin, self.p_lim = vmax, vmin, p_lim
+        self.max_line_loading, self.max_trafo_loading = max_line_loading, max_trafo_loading
+        self.bus_index = net.bus.index
+        self._load_buses = None
+        self._load_pos = None
+
+    def valid(self, net):
+        return net.bus.index is self.bus_index
+
+    def _load_bus_positions(self, net):
+        # the load buses only change when a load, e.g. the probe of a capacity search, is moved or parked,
+        # out of service loads need no supply
+        load_buses = np.unique(net.load.bus.values[net.load.in_service.values.astype(bool)])
+        if self._load_buses is None or not np.array_equal(load_buses, self._load_buses):
+            self._load_buses = load_buses
+            self._load_pos = self.bus_index.get_indexer(load_buses)
+        return self._load_buses, self._load_pos
+
+    def check(self, net):
+        '''
+        Checks the results of the last power flow of net
+
+        Returns violations and violation_exp as check_violations, the explanation is built when it is read
+        '''
+        vm = net.res_bus.vm_pu.values
+        with np.errstate(invalid='ignore'):
+            upper = vm > self.vmax
+            lower = vm < self.vmin
+            line = net.res_line.loading_percent.values > self.max_line_loading
+            trafo = net.res_trafo.loading_percent.values > self.max_trafo_loading
+            ext = bool((net.res_ext_grid.p_mw.values > self.p_lim).any())
+        load_buses, load_pos = self._load_bus_positions(net)
+        unsupplied = np.isnan(vm[load_pos])
+        violations = (bool(upper.any()), bool(lower.any()), bool(line.any()), bool(trafo.any()), ext,
+                      bool(unsupplied.any()), False)
+        return violations, ViolationExplanation(net, upper, lower, line, trafo, ext, load_buses, unsupplied)
+
+
+# Compiled checks of check_violations per set of limits
+_checks = {}
+
+
+def violation_check(net, vmax=1.1, vmin=0.9, max_line_loading=100., max_trafo_loading=100., p_lim=1000.):
+    '''
+    Returns the ViolationCheck of net for the limits, built on the first call and reused while net keeps its buses
+    '''
+    key = (vmax, vmin, max_line_loading, max_trafo_loading, p_lim)
+    check = _checks.get(key)
+    if check is None or not check.valid(net):
+        check = _checks[key] = ViolationCheck(net, *key)
+    return check
+
+
+def check_violations(net, run_control = False, vmax=1.1, vmin=0.9, max_line_loading=100., max_trafo_loading=100., p_lim=1000., init="auto"):
     '''
 
     Parameters
@@ -22,6 +347,9 @@ def check_violations(net, run_control = False, vmax=1.1, vmin=0.9, max_line_load
     max_line_loading : Max line loading limit to check. The default is 100.
     max_trafo_loading : Max trafo loading limit to check. The default is 100.
     p_lim : Max injected power in ext_grid. Default 1000.
+    init : Initialization of the power flow, passed to pp.runpp. With "results" the power flow starts
+           from the voltages in net.res_bus. Power flows that do not converge are retried on the rungs
+           of solver_ladder, see SolverLadder. not_converged is only set when every rung failed.
 
     Returns which limits have been broken
     -------
@@ -33,47 +361,332 @@ def check_violations(net, run_control = False, vmax=1.1, vmin=0.9, max_line_load
     unsupplied: True or False
     not_converged: True or False
 
+    violation_exp is a ViolationExplanation, the names of the violating elements are only looked up when it is read
+
     '''
     check_violations.counter+=1
-    upper_voltage = False
-    lower_voltage = False
-    line_loading = False
-    trafo_loading = False
-    ext_limit = False
-    unsupplied = False
-    not_converged = False
-    violation_exp = [None] * 7
     try:
-        pp.runpp(net,run_control=run_control)
-        if net.res_bus.vm_pu.max() > vmax:
-            upper_voltage = True
-            violation_exp[0] = [x for x in net.bus.name[net.res_bus.vm_pu > vmax]]
-        if net.res_bus.vm_pu.min() < vmin:
-            lower_voltage = True
-            violation_exp[1] = [x for x in net.bus.name[net.res_bus.vm_pu < vmin]]
-        if net.res_line.loading_percent.max() > max_line_loading:
-            line_loading = True
-            violation_exp[2] = [x for x in net.line.index[net.res_line.loading_percent > max_line_loading]]#'Line ' + ", ".join() + ' overloaded'
-        if net.res_trafo.loading_percent.max() > max_trafo_loading:
-            trafo_loading = True
-            violation_exp[3] = [x.replace("'",'').replace(' ','') for x in net.trafo.name[net.res_trafo.loading_percent > max_trafo_loading]]#'Trafo ' + ", ".join() + ' overloaded'
-        if (net.res_ext_grid.p_mw > p_lim).any():
-            ext_limit = True
-            violation_exp[4] = 'Ext grid subscription overloaded'
-
-        if (net.res_bus.loc[net.load.bus].isnull().values.any()):
-            unsupplied = True
-            df = net.res_bus.loc[net.load.bus.unique()]
-            violation_exp[5] = [x for x in net.bus.name.loc[df['vm_pu'].index[df['vm_pu'].apply(np.isnan)]]]#'Load bus ' + + ' not supplied.'
-
-    except:
-        not_converged = True
-        violation_exp[6] = True
-    #print(upper_voltage, lower_voltage, line_loading, trafo_loading, ext_limit, unsupplied,not_converged)
-    return (upper_voltage, lower_voltage, line_loading, trafo_loading, ext_limit, unsupplied,
-            not_converged), violation_exp
-
-def contingency_test(net, run_control = False, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000., contingency_scenario = [[],[]]):
+        _runpp(net, run_control, init)
+    except Exception:
+        return (False, False, False, False, False, False, True), [None] * 6 + [True]
+    return violation_check(net, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading,
+                           max_trafo_loading=max_trafo_loading, p_lim=p_lim).check(net)
+
+reset_counters()
+
+
+def violation_margins(net, vmax=1.1, vmin=0.9, max_line_loading=100., max_trafo_loading=100., p_lim=1000.):
+    '''
+    Signed distance to each limit for the power flow results in net, positive when the limit is kept.
+    Limits without any monitored element get the margin inf.
+
+    Returns dict
+    -------
+    upper_voltage : vmax - highest vm_pu
+    lower_voltage : lowest vm_pu - vmin
+    line_loading : max_line_loading - highest line loading_percent
+    trafo_loading : max_trafo_loading - highest trafo loading_percent
+    ext_limit : p_lim - highest ext_grid p_mw
+    relative : smallest of the margins above relative to their limits
+    '''
+    margins = {'upper_voltage': vmax - net.res_bus.vm_pu.max(),
+               'lower_voltage': net.res_bus.vm_pu.min() - vmin,
+               'line_loading': max_line_loading - net.res_line.loading_percent.max(),
+               'trafo_loading': max_trafo_loading - net.res_trafo.loading_percent.max(),
+               'ext_limit': p_lim - net.res_ext_grid.p_mw.max()}
+    margins = {k: np.inf if np.isnan(v) else float(v) for k, v in margins.items()}
+    margins['relative'] = min(margins['upper_voltage'] / vmax,
+                              margins['lower_voltage'] / vmin,
+                              margins['line_loading'] / max_line_loading,
+                              margins['trafo_loading'] / max_trafo_loading,
+                              margins['ext_limit'] / p_lim)
+    return margins
+
+
+def check_margins(net, run_control = False, vmax=1.1, vmin=0.9, max_line_loading=100., max_trafo_loading=100., p_lim=1000., init="auto",
+                  margins=True):
+    '''
+    Same as check_violations, but also returns the margins to the limits, see violation_margins.
+    With margins=False the margins are not computed and None is returned for them.
+
+    Returns
+    -------
+    violations : tuple of bool, as check_violations
+    violation_exp : list, as check_violations
+    margins : dict, None if the power flow did not converge
+    '''
+    violations, violation_exp = check_violations(net, run_control=run_control, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading,
+                                                 max_trafo_loading=max_trafo_loading, p_lim=p_lim, init=init)
+    if not margins or violations[6]:
+        return violations, violation_exp, None
+    return violations, violation_exp, violation_margins(net, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading,
+                                                        max_trafo_loading=max_trafo_loading, p_lim=p_lim)
+
+
+def _worst_margin(worst, margins):
+    if worst is None or margins is None:
+        return None
+    return min(worst, margins['relative'])
+
+
+def _outage_critical(net, element, element_id, run_control, limits):
+    '''
+    Checks one outage of the contingency_test, None if the element is already out of service.
+    The element is put back in service and the controllers are restored to their initial state afterwards.
+    '''
+    if not net[element].loc[element_id, 'in_service']:
+        return None
+    # every outage gets the full solver ladder, as in a worker process
+    solver_ladder.reset()
+    net[element].loc[element_id, 'in_service'] = False
+    check,_ = check_violations(net, run_control = run_control, **limits)
+    net[element].loc[element_id, 'in_service'] = True
+    #Restore all controlers to inital state
+    reset_all_controllers(net)
+    return True in check
+
+
+def _outage_set_results(net, outage_set, run_control):
+    '''
+    Runs the power flow with the elements of outage_set, a list of (element, index), out of service and returns its
+    results for ContingencyResults, None if an element is already out of service. The elements are put back in service
+    and the controllers are restored to their initial state afterwards.
+
+    OUTPUT
+        converged (bool), solve_time (float, s), values (tuple of arrays vm_pu, line loading_percent,
+        trafo loading_percent and ext_grid p_mw, None if not converged)
+    '''
+    if not all(net[element].loc[element_id, 'in_service'] for element, element_id in outage_set):
+        return None
+    solver_ladder.reset()
+    for element, element_id in outage_set:
+        net[element].loc[element_id, 'in_service'] = False
+    check_violations.counter += 1
+    start = perf_counter()
+    values = None
+    try:
+        _runpp(net, run_control, "auto")
+        values = (net.res_bus.vm_pu.values.copy(), net.res_line.loading_percent.values.copy(),
+                  net.res_trafo.loading_percent.values.copy(), net.res_ext_grid.p_mw.values.copy())
+    except Exception:
+        pass
+    solve_time = perf_counter() - start
+    for element, element_id in outage_set:
+        net[element].loc[element_id, 'in_service'] = True
+    #Restore all controlers to inital state
+    reset_all_controllers(net)
+    return values is not None, solve_time, values
+
+
+def _outage_results(net, element, element_id, run_control):
+    return _outage_set_results(net, [(element, element_id)], run_control)
+
+
+def _pair_results(net, first, second, run_control):
+    return _outage_set_results(net, [first, second], run_control)
+
+
+def _outage_index(outages, pairs=False):
+    '''
+    Index (element, index) of outages, (element, index, element2, index2) for pairs
+    '''
+    pairs = pairs or bool(outages) and isinstance(outages[0][0], tuple)
+    names = ['element', 'index', 'element2', 'index2'] if pairs else ['element', 'index']
+    if not outages:
+        return pd.MultiIndex.from_arrays([[]] * len(names), names=names)
+    if pairs:
+        return pd.MultiIndex.from_tuples([first + second for first, second in outages], names=names)
+    return pd.MultiIndex.from_tuples(outages, names=names)
+
+
+class ContingencyResults:
+    '''
+    Post-contingency results of every outage of an N-1 study, one row per outage in preallocated arrays, see run_contingencies.
+    The limits are only applied when the results are evaluated, so that one study can be checked against several limits.
+
+    Attributes
+    ----------
+    outages : list of (element, index), or of pairs ((element, index), (element, index)) for N-2, in the order of the rows
+    tested : bool array, False for outages of elements that were already out of service
+    converged : bool array, False for outages whose power flow did not converge
+    solve_time : float array, time of the power flow of every outage (s)
+    vm_pu : array outages x net.bus, NaN for unsupplied buses and outages without results
+    line_loading : array outages x net.line, loading_percent
+    trafo_loading : array outages x net.trafo, loading_percent
+    ext_p : array outages x net.ext_grid, p_mw
+    '''
+
+    def __init__(self, net, outages):
+        n = len(outages)
+        self.outages = list(outages)
+        self.bus_index, self.line_index, self.trafo_index = net.bus.index, net.line.index, net.trafo.index
+        self.ext_grid_index = net.ext_grid.index
+        # buses of the loads in service that make an outage unsupplied, see check_violations
+        self.load_bus_pos = net.bus.index.get_indexer(
+            np.unique(net.load.bus.values[net.load.in_service.values.astype(bool)]))
+        self.tested = np.zeros(n, dtype=bool)
+        self.converged = np.zeros(n, dtype=bool)
+        self.solve_time = np.zeros(n)
+        self.vm_pu = np.full((n, len(net.bus)), np.nan)
+        self.line_loading = np.full((n, len(net.line)), np.nan)
+        self.trafo_loading = np.full((n, len(net.trafo)), np.nan)
+        self.ext_p = np.full((n, len(net.ext_grid)), np.nan)
+
+    def index(self):
+        '''
+        Index of the rows, (element, index) or (element, index, element2, index2) for pairs
+        '''
+        return _outage_index(self.outages)
+
+    def set_outage(self, j, result):
+        '''
+        Stores the result of _outage_results for the outage in row j
+        '''
+        if result is None:
+            return
+        converged, solve_time, values = result
+        self.tested[j], self.converged[j], self.solve_time[j] = True, converged, solve_time
+        if converged:
+            self.vm_pu[j], self.line_loading[j], self.trafo_loading[j], self.ext_p[j] = values
+
+    def _nanmax(self, values, sign=1.):
+        # max over the elements of every outage, -inf without results
+        return sign * np.max(np.where(np.isnan(values), -np.inf, sign * values), axis=1, initial=-np.inf)
+
+    def violations(self, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000.):
+        '''
+        Broken limits of every outage as in check_violations, outages that were not tested break none
+
+        Returns DataFrame
+        -------
+        One row per outage, index (element, index), one bool column per name in VIOLATIONS
+        '''
+        converged = self.converged
+        violations = np.zeros((len(self.outages), len(VIOLATIONS)), dtype=bool)
+        violations[:, 0] = converged & (self._nanmax(self.vm_pu) > vmax)
+        violations[:, 1] = converged & (self._nanmax(self.vm_pu, -1.) < vmin)
+        violations[:, 2] = converged & (self._nanmax(self.line_loading) > max_line_loading)
+        violations[:, 3] = converged & (self._nanmax(self.trafo_loading) > max_trafo_loading)
+        violations[:, 4] = converged & (self._nanmax(self.ext_p) > p_lim)
+        violations[:, 5] = converged & np.isnan(self.vm_pu[:, self.load_bus_pos]).any(axis=1)
+        violations[:, 6] = self.tested & ~converged
+        return pd.DataFrame(violations, index=self.index(), columns=list(VIOLATIONS))
+
+    def margins(self, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000.):
+        '''
+        Margins to the limits of every outage as in violation_margins, NaN for outages without results
+
+        Returns DataFrame
+        -------
+        One row per outage, index (element, index), columns upper_voltage, lower_voltage, line_loading,
+        trafo_loading, ext_limit and relative
+        '''
+        margins = pd.DataFrame({'upper_voltage': vmax - self._nanmax(self.vm_pu),
+                                'lower_voltage': self._nanmax(self.vm_pu, -1.) - vmin,
+                                'line_loading': max_line_loading - self._nanmax(self.line_loading),
+                                'trafo_loading': max_trafo_loading - self._nanmax(self.trafo_loading),
+                                'ext_limit': p_lim - self._nanmax(self.ext_p)},
+                               index=self.index())
+        margins['relative'] = np.min([margins.upper_voltage / vmax, margins.lower_voltage / vmin,
+                                      margins.line_loading / max_line_loading, margins.trafo_loading / max_trafo_loading,
+                                      margins.ext_limit / p_lim], axis=0)
+        margins[~self.converged] = np.nan
+        return margins
+
+    def frame(self, name):
+        '''
+        One of the result arrays 'vm_pu', 'line_loading', 'trafo_loading' or 'ext_p' as DataFrame,
+        index (element, index) of the outages and the index of the elements as columns
+        '''
+        columns = {'vm_pu': self.bus_index, 'line_loading': self.line_index, 'trafo_loading': self.trafo_index,
+                   'ext_p': self.ext_grid_index}[name]
+        return pd.DataFrame(getattr(self, name), columns=columns, index=self.index())
+
+    def failed(self, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000.):
+        '''
+        Outages that break one or more limits, in the order of outages
+        '''
+        failed = self.violations(vmax=vmax, vmin=vmin, max_line_loading=max_line_loading,
+                                 max_trafo_loading=max_trafo_loading, p_lim=p_lim).any(axis=1).values
+        return [outage for outage, fail in zip(self.outages, failed) if fail]
+
+    def critical(self, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000.):
+        '''
+        critical_lines, critical_trafos as returned by contingency_test for the limits
+        '''
+        failed = self.failed(vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading,
+                             p_lim=p_lim)
+        critical_lines = [i for element, i in failed if element == 'line']
+        critical_trafos = [i for element, i in failed if element == 'trafo']
+        return critical_lines, critical_trafos
+
+
+# Base net and check of a contingency worker process, shipped once by the pool initializer
+_worker_net = None
+_worker_check = None
+
+
+def _init_contingency_worker(net, check):
+    global _worker_net, _worker_check
+    _worker_net = net
+    _worker_check = check
+
+
+def _contingency_worker(element, element_id):
+    '''
+    Runs one outage on the worker's own copy of the net with the check function and arguments of the pool.
+
+    OUTPUT
+        result - Result of the check function, see _outage_critical and _outage_results
+        counters (dict) - Power flow statistics of the check, see get_counters
+    '''
+    reset_counters()
+    check, args = _worker_check
+    result = check(_worker_net, element, element_id, *args)
+    return result, get_counters()
+
+
+def _run_outages(net, outages, check, args, workers):
+    '''
+    Runs check(net, element, index, *args) for every outage, in a process pool with more than one worker.
+    The results are in the order of outages in both modes.
+    '''
+    if workers is None or workers <= 1 or len(outages) <= 1:
+        return [check(net, element, element_id, *args) for element, element_id in outages]
+    chunksize = max(1, len(outages) // (4 * workers))
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_contingency_worker,
+                             initargs=(net, (check, args))) as pool:
+        # map keeps the order of the outages whatever worker finishes first
+        for result, counters in pool.map(_contingency_worker, *zip(*outages), chunksize=chunksize):
+            add_counters(counters)
+            results.append(result)
+    return results
+
+
+def run_contingencies(net, run_control = False, contingency_scenario = [[],[]], workers=None):
+    '''
+    Runs the power flow of every outage of contingency_scenario and keeps the results, see ContingencyResults.
+
+    Parameters
+    ----------
+    net : A pandapower network
+    run_control: bool, include controllers in power flow
+    contingency_scenario : [lines to test, trafos to test]
+    workers : Number of worker processes, see contingency_test
+
+    Returns ContingencyResults
+    '''
+    outages = [('line', line_id) for line_id in contingency_scenario[0]]
+    outages += [('trafo', trafo_id) for trafo_id in contingency_scenario[1]]
+    results = ContingencyResults(net, outages)
+    for j, result in enumerate(_run_outages(net, outages, _outage_results, (run_control,), workers)):
+        results.set_outage(j, result)
+    return results
+
+
+def contingency_test(net, run_control = False, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000., contingency_scenario = [[],[]],
+                     workers=None, results=False):
     '''
     Parameters
     ----------
@@ -84,43 +697,157 @@ def contingency_test(net, run_control = False, vmax=1.12, vmin=0.88, max_line_lo
     max_line_loading : Max line loading limit to check. The default is 100.
     max_trafo_loading : Max trafo loading limit to check. The default is 100.
     p_lim : Max injected power in ext_grid. Default 1000.
+    workers : Number of worker processes. If None or 1 the outages are checked one after the other on net,
+              otherwise the net is shipped once to a process pool and every worker checks outages on its own copy.
+              The result is the same in both modes.
+    results : bool, also return the ContingencyResults of the outages, see run_contingencies
 
     Returns list of lines indecies, when these lines or trafos are 
     out-of-service one or more checks fail
     -------------
-    critical_lines: list of critical lines
-    critical_trafos: list of critical trafo
-    '''
-    line_to_test = contingency_scenario[0]
-    trafo_to_test = contingency_scenario[1]
-    critical_lines = []
-    critical_trafos = []
-    for line_id in line_to_test:
-        if net.line.loc[line_id, 'in_service']:
-            net.line.loc[line_id, 'in_service'] = False
-            check,_ = check_violations(net, run_control = run_control, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim)
-            
-            if True in check:
-                critical_lines.append(line_id)
-            net.line.loc[line_id, 'in_service'] = True
-            #Restore all controlers to inital state
-            reset_all_controllers(net)
-
-    for trafo_id in trafo_to_test:
-        if net.trafo.loc[trafo_id, 'in_service']:
-            net.trafo.loc[trafo_id, 'in_service'] = False
-            
-            check,_ = check_violations(net, run_control = run_control, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim)
-            
-            if True in check:
-                critical_trafos.append(trafo_id)
-            net.trafo.loc[trafo_id, 'in_service'] = True
-            #Restore all controlers to inital state
-            reset_all_controllers(net)
-    
+    critical_lines: list of critical lines, in the order of contingency_scenario
+    critical_trafos: list of critical trafo, in the order of contingency_scenario
+    results: ContingencyResults, only if results
+    '''
+    limits = dict(vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim)
+    if results:
+        contingency_results = run_contingencies(net, run_control=run_control, contingency_scenario=contingency_scenario,
+                                                workers=workers)
+        critical_lines, critical_trafos = contingency_results.critical(**limits)
+        return critical_lines, critical_trafos, contingency_results
+
+    outages = [('line', line_id) for line_id in contingency_scenario[0]]
+    outages += [('trafo', trafo_id) for trafo_id in contingency_scenario[1]]
+    critical = _run_outages(net, outages, _outage_critical, (run_control, limits), workers)
+    critical_lines = [element_id for (element, element_id), fail in zip(outages, critical) if fail and element == 'line']
+    critical_trafos = [element_id for (element, element_id), fail in zip(outages, critical) if fail and element == 'trafo']
     return critical_lines, critical_trafos
 
-def simple_contingency_test(net, run_control = False, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000., contingency_scenario = [[],[]]):
+def _superposed_safe(single, first, second, base, limits, bands):
+    '''
+    True if the superposition of the results of two single outages, x_first + x_second - x_base, keeps all limits
+    by the bands, see n2_contingency_test
+    '''
+    arrays = (single.vm_pu, single.line_loading, single.trafo_loading, single.ext_p)
+    vm, line, trafo, ext = (x[first] + x[second] - x_base for x, x_base in zip(arrays, base))
+    if np.isnan(vm[single.load_bus_pos]).any():
+        return False
+    # elements without results are not compared
+    with np.errstate(invalid='ignore'):
+        return not (np.any(vm > limits['vmax'] - bands['vm']) or np.any(vm < limits['vmin'] + bands['vm'])
+                    or np.any(line > limits['max_line_loading'] - bands['loading'])
+                    or np.any(trafo > limits['max_trafo_loading'] - bands['loading'])
+                    or np.any(ext > limits['p_lim'] * (1. - bands['p'])))
+
+
+def n2_contingency_test(net, run_control = False, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000., contingency_scenario = [[],[]],
+                        pairs=None, workers=None, coupling=0.05, bands=None):
+    '''
+    N-1 of contingency_scenario and N-2 of pairs of its outages. The N-1 results decide the pairs where they prove the result:
+    a pair with a critical outage is critical, and a pair of weakly coupled outages (see contingency.pair_coupling) whose
+    superposed N-1 results keep all limits by the bands is safe. Only the other pairs are run with AC power flows.
+
+    Parameters
+    ----------
+    net, run_control, vmax, vmin, max_line_loading, max_trafo_loading, p_lim, contingency_scenario : see contingency_test
+    pairs : list of ((element, index), (element, index)) to test, all pairs of the outages of contingency_scenario if None
+    workers : Number of worker processes for the N-1 and the AC checks of the pairs, see contingency_test
+    coupling : Largest coupling of the outages of a pair that is decided from the superposed N-1 results
+    bands : Bands of the superposed results to the limits, 'loading' (percent points), 'vm' (pu) and 'p' (share of p_lim),
+            see contingency.SCREEN_BANDS
+
+    Returns
+    -------
+    critical_lines, critical_trafos : as contingency_test
+    critical_pairs : list of the pairs that break a limit
+    pair_status : DataFrame, one row per pair, index (element, index, element2, index2), columns status
+                  (contingency.VIOLATING or SAFE when decided from the N-1 results, CHECK when run) and critical
+    '''
+    limits = dict(vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim)
+    bands = dict(contingency.SCREEN_BANDS, **(bands or {}))
+    single = run_contingencies(net, run_control=run_control, contingency_scenario=contingency_scenario, workers=workers)
+    failed = set(single.failed(**limits))
+    row = {outage: j for j, outage in enumerate(single.outages)}
+    pairs = contingency.outage_pairs(single.outages, pairs)
+
+    # intact case for the superposition and the coupling of the outages in service
+    converged, _, base = _outage_set_results(net, [], run_control)
+    in_service = [outage for j, outage in enumerate(single.outages) if single.tested[j]]
+    if converged and len(in_service) > 1:
+        pair_coupling = contingency.pair_coupling(net, in_service)
+        pos = {outage: k for k, outage in enumerate(in_service)}
+
+    statuses = []
+    for first, second in pairs:
+        a, b = row[first], row[second]
+        if first in failed or second in failed:
+            statuses.append(contingency.VIOLATING)
+        elif not single.tested[a] or not single.tested[b]:
+            # an element out of service leaves the other outage, that is not critical
+            statuses.append(contingency.SAFE)
+        elif (converged and single.converged[a] and single.converged[b]
+              # NaN for outages that split the net is never weakly coupled
+              and np.all(pair_coupling[[pos[first], pos[second]], [pos[second], pos[first]]] < coupling)
+              and _superposed_safe(single, a, b, base, limits, bands)):
+            statuses.append(contingency.SAFE)
+        else:
+            statuses.append(contingency.CHECK)
+
+    check_pairs = [pair for pair, status in zip(pairs, statuses) if status == contingency.CHECK]
+    pair_results = ContingencyResults(net, check_pairs)
+    for j, result in enumerate(_run_outages(net, check_pairs, _pair_results, (run_control,), workers)):
+        pair_results.set_outage(j, result)
+    ac_failed = set(pair_results.failed(**limits))
+
+    critical_pairs = [pair for pair, status in zip(pairs, statuses) if status == contingency.VIOLATING or pair in ac_failed]
+    critical_lines, critical_trafos = single.critical(**limits)
+    pair_status = pd.DataFrame({'status': statuses, 'critical': [pair in critical_pairs for pair in pairs]},
+                               index=_outage_index(pairs, pairs=True))
+    return critical_lines, critical_trafos, critical_pairs, pair_status
+
+
+def maintenance_contingency_test(grid, run_control = False, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000.,
+                                 contingency_scenario = [[],[]], days=None, n2=False, pairs=None, workers=None, coupling=0.05, bands=None):
+    '''
+    N-1 of contingency_scenario on top of the planned work of every day in grid.config_dict, and N-2 with n2 or pairs.
+    Days with the same planned changes are studied once, see contingency.maintenance_configs.
+
+    Parameters
+    ----------
+    grid : Grid with the planned projects, its net is configured for every studied configuration and restored afterwards
+    run_control, vmax, vmin, max_line_loading, max_trafo_loading, p_lim, contingency_scenario : see contingency_test
+    days : Days to study, all days of grid.config_dict if None
+    n2 : bool, also test all pairs of outages, see n2_contingency_test
+    pairs, workers, coupling, bands : see n2_contingency_test
+
+    Returns DataFrame
+    -------
+    One row per day, columns critical_lines, critical_trafos and critical_pairs
+    '''
+    limits = dict(vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim)
+    results = {}
+    for config, config_days in contingency.maintenance_configs(grid, days):
+        grid.active_config = config
+        grid.config()
+        try:
+            if n2 or pairs is not None:
+                critical_lines, critical_trafos, critical_pairs, _ = n2_contingency_test(
+                    grid.grid, run_control=run_control, contingency_scenario=contingency_scenario, pairs=pairs,
+                    workers=workers, coupling=coupling, bands=bands, **limits)
+            else:
+                critical_lines, critical_trafos = contingency_test(grid.grid, run_control=run_control,
+                                                                   contingency_scenario=contingency_scenario,
+                                                                   workers=workers, **limits)
+                critical_pairs = []
+        finally:
+            grid.restore()
+        for day in config_days:
+            results[day] = (critical_lines, critical_trafos, critical_pairs)
+    return pd.DataFrame.from_dict(results, orient='index', columns=['critical_lines', 'critical_trafos', 'critical_pairs'])
+
+
+def simple_contingency_test(net, run_control = False, vmax=1.12, vmin=0.88, max_line_loading=120., max_trafo_loading=120., p_lim=1000., contingency_scenario = [[],[]], init="auto",
+                            margins=False, engine=None, probe_bus=None, controllers=None):
     '''
     Parameters
     ----------
@@ -131,36 +858,96 @@ def simple_contingency_test(net, run_control = False, vmax=1.12, vmin=0.88, max_
     max_line_loading : Max line loading limit to check. The default is 100.
     max_trafo_loading : Max trafo loading limit to check. The default is 100.
     p_lim : Max injected power in ext_grid. Default 1000.
+    init : Initialization of the power flows. With "results" every outage starts from the
+           voltages in net.res_bus when the test is called, e.g. the converged intact case.
+    margins : bool, also return the smallest relative margin (see violation_margins) of the tested outages,
+              None if an outage did not converge
+    engine : contingency.ContingencyEngine built for contingency_scenario on this configuration of the net.
+             The outages are screened from the results of the intact case in net, outages screened as violating
+             fail the test without a power flow and outages screened as safe are not run.
+             Outages that island load fail without a power flow, see contingency.islanded_buses.
+             With an engine the outages are tested in the order of engine.order() and failures are recorded in the engine.
+    probe_bus : Bus of the probed capacity, outages pruned by the engine for this bus are skipped, see ContingencyEngine.groups
+    controllers : ControllerWarmStart, every outage starts the controllers from the positions its last converged
+                  check converged to, instead of the initial state, and stores the positions it converges to
 
     Returns True if all scenarios i feasible, False if at least one scenario fails
     -------------
     critical_lines: list of critical lines
+
+    The failing outage is kept in simple_contingency_test.failed as (element, index, violations), None if all pass,
+    and the elements it violates in simple_contingency_test.failed_elements, see violated_elements
     '''
-    line_to_test = contingency_scenario[0]
-    trafo_to_test = contingency_scenario[1]
     scenario_counter = 0
-    for line_id in line_to_test:
-        if net.line.loc[line_id, 'in_service']:
-            net.line.loc[line_id, 'in_service'] = False
-            check,_ = check_violations(net, run_control = run_control, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim)
-            scenario_counter +=1
-            if True in check:
-                net.line.loc[line_id, 'in_service'] = True
+    simple_contingency_test.failed = None
+    simple_contingency_test.failed_elements = None
+    worst = np.inf
+    if engine is None:
+        outages = [('line', line_id) for line_id in contingency_scenario[0]]
+        outages += [('trafo', trafo_id) for trafo_id in contingency_scenario[1]]
+        classes = [contingency.CHECK] * len(outages)
+        groups = [range(len(outages))]
+    else:
+        outages = engine.outages
+        classes, screened, screened_margins = engine.screen(net, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading,
+                                                            max_trafo_loading=max_trafo_loading, p_lim=p_lim,
+                                                            run_control=run_control)
+        groups = engine.groups(probe_bus, classes)
+    if init == "results":
+        state = get_pf_state(net)
+
+    # the second group only holds the pruned outages of a validating engine
+    for pruned, order in enumerate(groups):
+        for j in order:
+            if classes[j] == contingency.VIOLATING:
+                element, element_id = outages[j]
+                simple_contingency_test.failed = (element, element_id, screened[j])
+                simple_contingency_test.failed_elements = violated_elements(None)
+                engine.record_failure(j)
+                if pruned:
+                    engine.record_pruning_error(probe_bus, j)
+                if margins:
+                    # islanded load leaves no usable margin
+                    margin = None if np.isnan(screened_margins[j]) else min(screened_margins[j], 0.)
+                    return False, scenario_counter, margin
                 return False, scenario_counter
-            net.line.loc[line_id, 'in_service'] = True
-            #Restore all controlers to inital state
-            reset_all_controllers(net)
+            if classes[j] == contingency.SAFE:
+                worst = min(worst, screened_margins[j])
 
-    for trafo_id in trafo_to_test:
-        if net.trafo.loc[trafo_id, 'in_service']:
-            net.trafo.loc[trafo_id, 'in_service'] = False
-            check,_ = check_violations(net, run_control = run_control, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim)
+        for j in order:
+            element, element_id = outages[j]
+            if classes[j] != contingency.CHECK or not net[element].loc[element_id, 'in_service']:
+                continue
+            net[element].loc[element_id, 'in_service'] = False
+            if init == "results":
+                set_pf_state(net, state)
+            if controllers is not None:
+                controllers.restore(net, (element, element_id))
+            check,outage_exp,outage_margins = check_margins(net, run_control = run_control, vmax=vmax, vmin=vmin, max_line_loading=max_line_loading, max_trafo_loading=max_trafo_loading, p_lim=p_lim, init=init,
+                                                            margins=margins)
+            if controllers is not None and not check[6]:
+                controllers.store(net, (element, element_id))
             scenario_counter +=1
+            if margins:
+                worst = _worst_margin(worst, outage_margins)
+            net[element].loc[element_id, 'in_service'] = True
             if True in check:
-                net.trafo.loc[trafo_id, 'in_service'] = True
+                simple_contingency_test.failed = (element, element_id, check)
+                simple_contingency_test.failed_elements = violated_elements(outage_exp)
+                if engine is not None:
+                    engine.record_failure(j)
+                    if pruned:
+                        engine.record_pruning_error(probe_bus, j)
+                if margins:
+                    return False, scenario_counter, worst
                 return False, scenario_counter
-            net.trafo.loc[trafo_id, 'in_service'] = True
             #Restore all controlers to inital state
-            reset_all_controllers(net)
-    
+            if controllers is None:
+                reset_all_controllers(net)
+
+    if margins:
+        return True, scenario_counter, worst
     return True, scenario_counter
+
+simple_contingency_test.failed = None
+simple_contingency_test.failed_elements = None
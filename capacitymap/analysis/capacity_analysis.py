@@ -2,10 +2,17 @@
 # Copyright Contributors to Grid Capacity Map
 
 import pandas as pd
-from time import sleep
+import numpy as np
 import sys
+import threading
+from time import perf_counter
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import networkx as nx
 import pandapower as pp
-from capacitymap.analysis import analysis_check
+import pandapower.topology as top
+from capacitymap.analysis import analysis_check, sensitivity, headroom_cache, contingency
+from capacitymap.controllers.controller_functions import reset_all_controllers, ControllerWarmStart
 
 def add_loadgen(net_t, loadorgen, conn_at_bus, size_p, size_q):
     """
@@ -50,7 +57,93 @@ def remove_added_loadgen(net_t, loadorgen):
     return net_t
 
 
-def feas_chk(net, conn_at_bus, loadorgen, size_p, size_q, normal_limits, contingency_limits,contingency_scenario ):
+def create_probe(net_t, loadorgen):
+    """
+    Creates an out of service load or sgen named Cap test, used as probe for all checks of a capacity search.
+    The probe is moved and resized in place by set_probe, so the element tables keep their size and index.
+
+    INPUT
+        net_t (PP net) - Pandapower net
+        loadorgen (str) - 'sgen' or 'load' for generation or load for additional capacity connected
+
+    OUTPUT
+        probe (int) - Index of the probe in net_t.load or net_t.sgen
+    """
+    if loadorgen == "load":
+        return pp.create_load(net_t, net_t.bus.index[0], p_mw=0., q_mvar=0., name='Cap test', in_service=False)
+
+    elif loadorgen == "sgen":
+        return pp.create_sgen(net_t, net_t.bus.index[0], p_mw=0., q_mvar=0., name='Cap test', in_service=False)
+
+
+def set_probe(net_t, loadorgen, probe, conn_at_bus, size_p, size_q):
+    """
+    Moves the probe to conn_at_bus, sets its size and puts it in service
+
+    INPUT
+        net_t (PP net) - Pandapower net
+        loadorgen (str) - 'sgen' or 'load' for generation or load for additional capacity connected
+        probe (int) - Index of the probe from create_probe
+        conn_at_bus (int) - Bus at which additional capacity is connected
+
+    OUTPUT
+        net_t (PP net) - Updated Pandapower net
+    """
+    table = net_t[loadorgen]
+    table.at[probe, 'bus'] = conn_at_bus
+    table.at[probe, 'p_mw'] = size_p
+    table.at[probe, 'q_mvar'] = size_q
+    table.at[probe, 'in_service'] = True
+    return net_t
+
+
+def park_probe(net_t, loadorgen, probe):
+    """
+    Takes the probe out of service, the counterpart of remove_added_loadgen for a probe
+    """
+    net_t[loadorgen].at[probe, 'in_service'] = False
+    return net_t
+
+
+def remove_probe(net_t, loadorgen, probe):
+    """
+    Removes the probe from net_t.load or net_t.sgen
+    """
+    net_t[loadorgen] = net_t[loadorgen].drop(probe)
+    return net_t
+
+
+class WarmStart:
+    """
+    Keeps the bus voltages of the last converged power flow of a capacity search,
+    every probe of the search starts its power flow from them instead of a flat start.
+
+    INPUT
+        state (DataFrame) - Start voltages from analysis_check.get_pf_state, e.g. of the base case.
+                            If None the first probe starts flat.
+        controllers (bool) - Also start the controllers of every check from the positions of the previous
+                             converged check with the same topology, see ControllerWarmStart
+    """
+
+    def __init__(self, state=None, controllers=False):
+        self.state = state
+        self.controllers = ControllerWarmStart() if controllers else None
+
+    def restore(self, net):
+        """
+        Writes the stored voltages to net.res_bus and returns the init option for the power flow
+        """
+        if self.state is None:
+            return "auto"
+        analysis_check.set_pf_state(net, self.state)
+        return "results"
+
+    def store(self, net):
+        self.state = analysis_check.get_pf_state(net)
+
+
+def feas_chk(net, conn_at_bus, loadorgen, size_p, size_q, normal_limits, contingency_limits,contingency_scenario, warm_start=None,
+             margin=False, probe=None, engine=None):
     """
     Initializes the PPnet,
     Adds additional capacity,
@@ -64,70 +157,298 @@ def feas_chk(net, conn_at_bus, loadorgen, size_p, size_q, normal_limits, conting
         conn_at_bus (int) - Bus at which additional capacity is connected
         size_p (int) - Size of active power of additional capacity
         size_q (int) - Size of reactive power of additional capacity
+        warm_start (WarmStart) - If given the power flows start from its voltages and it is updated
+                                 with the converged normal operation of this check
+        margin (bool) - Also return the smallest relative margin to the limits of the checked cases
+        probe (int) - Index of a probe from create_probe that is moved to the bus and resized,
+                      instead of adding and removing a load or sgen for the check
+        engine (ContingencyEngine) - Engine of contingency_scenario, see analysis_check.simple_contingency_test
 
     OUTPUT
         feas_result (bool) - 'True' for feasible, 'False' for not feasible
+        net (PP net) - Pandapower net
+        exp (list) - Explanation of the violations in normal operation, see check_violations
+        feas_margin (float) - Only if margin, smallest relative margin (see analysis_check.violation_margins),
+                              negative if not feasible, None if a power flow did not converge
+
+    The violation of the last check that was not feasible is kept as text in feas_chk.binding and the violated
+    elements, with the outage of a failing contingency, in feas_chk.binding_elements (see analysis_check.violated_elements)
     """
 
-    net = add_loadgen(net, loadorgen, conn_at_bus, size_p, size_q)
+    if probe is None:
+        net = add_loadgen(net, loadorgen, conn_at_bus, size_p, size_q)
+    else:
+        net = set_probe(net, loadorgen, probe, conn_at_bus, size_p, size_q)
+    init = "auto"
+    controllers = None
+    if warm_start is not None:
+        init = warm_start.restore(net)
+        controllers = warm_start.controllers
+    if controllers is not None:
+        controllers.restore(net)
     #check normal operations
     if normal_limits==None:
-        violation_results, exp = analysis_check.check_violations(net)
+        violation_results, exp, margins = analysis_check.check_margins(net, init=init, margins=margin)
     else:
-        violation_results, exp = analysis_check.check_violations(net,vmax=normal_limits['vmax'], 
+        violation_results, exp, margins = analysis_check.check_margins(net,vmax=normal_limits['vmax'], 
                                                                 vmin=normal_limits['vmin'], 
                                                                 max_line_loading=normal_limits['max_line_loading'], 
                                                                 max_trafo_loading=normal_limits['max_trafo_loading'], 
                                                                 p_lim=normal_limits['subscription_p_limits'],
-                                                                run_control=normal_limits['run_controllers'])
+                                                                run_control=normal_limits['run_controllers'],
+                                                                init=init,
+                                                                margins=margin)
     feas_result = not (True in violation_results)
+    if not feas_result:
+        feas_chk.binding = ", ".join(analysis_check.violation_names(violation_results))
+        feas_chk.binding_elements = analysis_check.violated_elements(exp)
+    feas_margin = None if margins is None else margins['relative']
+    not_converged = violation_results[6]
+    if warm_start is not None and not not_converged:
+        warm_start.store(net)
+        if controllers is not None:
+            controllers.store(net)
+        # outages start from the converged normal operation
+        init = "results"
 
     #if normal op. feasible, check contingency
     if feas_result:
 
         if contingency_limits is None:
             
-            feas_result,no_tests =analysis_check.simple_contingency_test(net, contingency_scenario=contingency_scenario)
+            contingency_result =analysis_check.simple_contingency_test(net, contingency_scenario=contingency_scenario, init=init, margins=margin,
+                                                                                     engine=engine, probe_bus=conn_at_bus,
+                                                                                     controllers=controllers)
         else:
-            feas_result,no_tests =analysis_check.simple_contingency_test(net,vmax=contingency_limits['vmax'], 
+            contingency_result =analysis_check.simple_contingency_test(net,vmax=contingency_limits['vmax'], 
                                                                 vmin=contingency_limits['vmin'], 
                                                                 max_line_loading=contingency_limits['max_line_loading'], 
                                                                 max_trafo_loading=contingency_limits['max_trafo_loading'], 
                                                                 p_lim=contingency_limits['subscription_p_limits'],
                                                                 run_control=contingency_limits['run_controllers'],
-                                                                contingency_scenario=contingency_scenario)
+                                                                contingency_scenario=contingency_scenario,
+                                                                init=init,
+                                                                margins=margin,
+                                                                engine=engine,
+                                                                probe_bus=conn_at_bus,
+                                                                controllers=controllers)
+        # the margins are only computed when they are asked for
+        feas_result = contingency_result[0]
+        cont_margin = contingency_result[2] if margin else None
+        feas_margin = None if cont_margin is None or feas_margin is None else min(feas_margin, cont_margin)
+        if not feas_result:
+            element, idx, check = analysis_check.simple_contingency_test.failed
+            feas_chk.binding = "%s %s out: %s" % (element, idx, ", ".join(analysis_check.violation_names(check)))
+            feas_chk.binding_elements = analysis_check.simple_contingency_test.failed_elements
+            feas_chk.binding_elements[element].append(idx)
       
 
 
         #print('Test power ' + str(size_p) + ' at bus '+ str(conn_at_bus))
         #print('Results contingency' + str(feas_result) + ' number of tested scenarios ' +  str(no_tests))
-    net = remove_added_loadgen(net, loadorgen)
+    if probe is None:
+        net = remove_added_loadgen(net, loadorgen)
+    else:
+        net = park_probe(net, loadorgen, probe)
+
+    # violations without a margin, e.g. unsupplied load, leave no usable margin
+    if feas_margin is not None and (feas_margin >= 0) != feas_result:
+        feas_margin = None
 
+    if margin:
+        return feas_result, net, exp, feas_margin
     return feas_result, net, exp
 
+feas_chk.binding = None
+feas_chk.binding_elements = None
+
 
-def max_cap(net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, s_tol, normal_limits, contingency_limits,contingency_scenario ):
+def _secant(x0, g0, x1, g1):
     """
-    ...
-    INPUT
+    Root of the straight line through (x0, g0) and (x1, g1), None if it is not defined
+    """
+    if g0 is None or g1 is None or g0 == g1:
+        return None
+    return x1 - g1 * (x1 - x0) / (g1 - g0)
+
+
+def _guess_bracket(net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, normal_limits, contingency_limits, contingency_scenario,
+                   warm_start, guess, guess_width, probe=None, engine=None):
+    """
+    Verifies a predicted max capacity with AC checks at guess + guess_width and guess - guess_width
 
     OUTPUT
+        lower_lim_p, lower_margin - Feasible end of the narrowed interval and its margin (None if unknown)
+        upper_lim_p, upper_margin - End of the narrowed interval and its margin (None if unknown)
+        upper_checked (bool) - True if upper_lim_p has been checked and is not feasible
+    """
+    test_p = min(guess + guess_width, upper_lim_p)
+    if test_p <= lower_lim_p:
+        return lower_lim_p, None, upper_lim_p, None, False
+    test_check, net, exp, test_margin = feas_chk(net, conn_at_bus, loadorgen, test_p, q, normal_limits, contingency_limits,
+                                                 contingency_scenario, warm_start, margin=True, probe=probe, engine=engine)
+    if test_check:
+        # prediction too low, search above it
+        return test_p, test_margin, upper_lim_p, None, False
+
+    upper_lim_p, upper_margin = test_p, test_margin
+    lower_margin = None
+    test_p = max(guess - guess_width, lower_lim_p)
+    if test_p > lower_lim_p:
+        test_check, net, exp, test_margin = feas_chk(net, conn_at_bus, loadorgen, test_p, q, normal_limits, contingency_limits,
+                                                     contingency_scenario, warm_start, margin=True, probe=probe, engine=engine)
+        if test_check:
+            lower_lim_p, lower_margin = test_p, test_margin
+        else:
+            # prediction too high, search below it
+            upper_lim_p, upper_margin = test_p, test_margin
+    return lower_lim_p, lower_margin, upper_lim_p, upper_margin, True
+
+
+def _guesses_key(guesses):
+    """
+    Given guesses of headroom as plain values for the cache key of a study, see headroom guesses
+    """
+    if guesses is None:
+        return None
+    if isinstance(guesses, dict):
+        return {direction: _guesses_key(g) for direction, g in guesses.items()}
+    return {str(bus): float(guess) for bus, guess in guesses.items()}
+
+
+def _bus_cache_key(net_hash, loadorgen, lower_lim_p, q, s_tol, normal_limits, contingency_limits, contingency_scenario,
+                   screen=None, prune=None, warm_controllers=False, method='bisection', predict=False, order=None,
+                   warm_start=False):
+    """
+    Cache key of the bus results of a study, upper_lim_p is handled by HeadroomCache.get_bus.
+    screen (dict) - Bands of a contingency screen, see contingency.ContingencyEngine
+    prune (float) - Threshold of the pruning of the outages per bus, see contingency.ContingencyEngine
+    warm_controllers (bool) - Controllers start from the previous check, see WarmStart
+    method (str) - Search method, see max_cap
+    predict (bool) - The search starts from a guess, predicted or given, see max_cap guess
+    order (str) - Order of the buses, 'topology' limits a bus by its upstream bus, see iter_headroom
+    warm_start (bool) - Power flows start from the previous probe, see WarmStart
+    The guess of a bus is part of its key in the cache, see max_cap.
+    """
+    params = {'method': method}
+    if warm_start:
+        params['warm_start'] = True
+    if predict:
+        params['predict'] = True
+    if order is not None:
+        params['order'] = order
+    if screen:
+        params['screen'] = screen
+    if prune is not None:
+        params['prune'] = prune
+    if warm_controllers:
+        params['warm_controllers'] = True
+    return headroom_cache.study_key(net_hash, loadorgen=loadorgen, lower_lim_p=lower_lim_p, q=q, s_tol=s_tol,
+                                    normal_limits=normal_limits, contingency_limits=contingency_limits,
+                                    contingency_scenario=contingency_scenario, **params)
+
 
+def _check_upper(upper_infeasible, *args, **kwargs):
     """
+    feas_chk of the upper limit of a search, without retries on the solver ladder if it is known to be infeasible
+    """
+    analysis_check.solver_ladder.retry = not upper_infeasible
+    try:
+        return feas_chk(*args, **kwargs)
+    finally:
+        analysis_check.solver_ladder.retry = True
+
+
+def max_cap(net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, s_tol, normal_limits, contingency_limits,contingency_scenario, warm_start=None,
+            method='bisection', guess=None, guess_width=None, probe=None, cache=None, cache_key=None, engine=None,
+            lower_margin=None, upper_infeasible=False):
+    """
+    Search for the max capacity that can be connected at a bus without violations
+
+    INPUT
+        net (PP net) - Pandapower net
+        conn_at_bus (int) - Bus at which additional capacity is connected
+        loadorgen (str) - 'sgen' or 'load' for generation or load for additional capacity connected
+        upper_lim_p (float) - Max capacity to test (MW)
+        lower_lim_p (float) - Min capacity, assumed to be feasible (MW)
+        q (float) - Reactive power of additional capacity (Mvar)
+        s_tol (float) - Tolerance of the search (MW)
+        warm_start (WarmStart) - Start values for the power flows, updated after every converged probe
+        method (str) - 'bisection' halves the search interval in every step.
+                       'secant', 'regula_falsi' and 'illinois' place the next probe where the margin to the
+                       limits (see analysis_check.violation_margins) is interpolated to zero,
+                       'secant' from the two last probes and 'regula_falsi' from the interval ends.
+                       'illinois' is regula falsi where the margin of an interval end that is kept twice is halved.
+                       Probes without a usable margin, e.g. not converged, fall back to bisection.
+        guess (float) - Predicted max capacity, e.g. from sensitivity.predict_headroom. The search starts with
+                        AC checks at guess +- guess_width and only continues in the interval they leave.
+        guess_width (float) - Half width of the checked interval around guess, default s_tol / 2
+        probe (int) - Index of a probe from create_probe used for all checks, see feas_chk
+        cache (HeadroomCache) - Cache for the result of the bus, see headroom_cache
+        cache_key (str) - Key of the study in the cache, from _bus_cache_key if None
+        engine (ContingencyEngine) - Engine of contingency_scenario for the contingency checks, e.g. to screen the
+                                     outages, see contingency.ContingencyEngine
+        lower_margin (float) - Margin of lower_lim_p from feas_chk, e.g. of the base case. The margin methods
+                               check lower_lim_p for its margin when needed if None
+        upper_infeasible (bool) - upper_lim_p is known to be infeasible, e.g. above the infeasible end of the search
+                                  of the upstream bus. Its check gets no retries on the solver ladder.
+
+    OUTPUT
+        lower_lim_p (float) - Max feasible capacity found (MW)
+    """
+    if cache is not None:
+        if cache_key is None:
+            cache_key = _bus_cache_key(headroom_cache.net_key(net), loadorgen, lower_lim_p, q, s_tol, normal_limits,
+                                       contingency_limits, contingency_scenario, method=method,
+                                       predict=guess is not None, warm_start=warm_start is not None)
+        if guess is not None and not np.isnan(guess):
+            # the probes around a guess can end at another point within s_tol
+            cache_key = headroom_cache.study_key(cache_key, guess=float(guess), guess_width=guess_width)
+        head = cache.get_bus(cache_key, conn_at_bus, upper_lim_p)
+        if head is None:
+            head = max_cap(net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, s_tol, normal_limits, contingency_limits,
+                           contingency_scenario, warm_start, method, guess, guess_width, probe, engine=engine,
+                           lower_margin=lower_margin, upper_infeasible=upper_infeasible)
+            cache.put_bus(cache_key, conn_at_bus, head, upper_lim_p, (feas_chk.binding, feas_chk.binding_elements))
+        else:
+            feas_chk.binding, feas_chk.binding_elements = cache.get_bus_binding(cache_key, conn_at_bus) or (None, None)
+        return head
+
     no_iter = 0
+    upper_margin, upper_checked = None, False
+    if guess is not None and not np.isnan(guess):
+        if guess_width is None:
+            guess_width = s_tol / 2
+        start_p = lower_lim_p
+        lower_lim_p, guess_margin, upper_lim_p, upper_margin, upper_checked = _guess_bracket(
+            net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, normal_limits, contingency_limits, contingency_scenario,
+            warm_start, guess, guess_width, probe, engine)
+        if lower_lim_p != start_p:
+            lower_margin = guess_margin
+        if lower_lim_p >= upper_lim_p:
+            print('Max capacity is available')
+            return upper_lim_p
+        if upper_checked:
+            # skip the check of the upper limit
+            no_iter = 1
+
+    if method != 'bisection':
+        return _max_cap_margin(net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, s_tol, normal_limits, contingency_limits,
+                               contingency_scenario, warm_start, method, lower_margin, upper_margin, upper_checked, probe,
+                               engine, upper_infeasible)
     [upper_lim_check, mid_check, lower_lim_chk] = False, False, False
     while (not (((upper_lim_p - lower_lim_p) < s_tol)) | (upper_lim_check & mid_check) | (no_iter > 10)):
         no_iter = no_iter + 1
         mid_p = lower_lim_p + (upper_lim_p - lower_lim_p) / 2
         #On first iteration test if upper limit is available and if true break
         if no_iter==1:
-            upper_lim_check, net, exp = feas_chk(net, conn_at_bus, loadorgen, upper_lim_p, q, normal_limits, contingency_limits,contingency_scenario)
+            upper_lim_check, net, exp = _check_upper(upper_infeasible, net, conn_at_bus, loadorgen, upper_lim_p, q, normal_limits, contingency_limits,contingency_scenario, warm_start, probe=probe, engine=engine)
             if upper_lim_check:
                 print('Max capacity is available')
                 return upper_lim_p
 
         else:
-            mid_check, net,exp = feas_chk(net, conn_at_bus, loadorgen, mid_p, q, normal_limits, contingency_limits,contingency_scenario )
+            mid_check, net,exp = feas_chk(net, conn_at_bus, loadorgen, mid_p, q, normal_limits, contingency_limits,contingency_scenario, warm_start, probe=probe, engine=engine)
             if mid_check:  # If mid point is feasible update lower lim, headroom above mid point
                 lower_lim_p = mid_p
                 
@@ -140,26 +461,669 @@ def max_cap(net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, s_tol, nor
     return lower_lim_p
 
 
-def headroom(net, loadorgen, upper_lim_p,normal_limits = None, contingency_limits=None,contingency_scenario=[[],[]]):
-    low_lim_p = 0  # min added load (MW)   ll_p
-    q = 0
-    s_tol = 5  # tolerance in search algorithm
-    headroom = pd.DataFrame(columns=["Headroom"])
-    
-    n=len(net.bus)
-    
-    analysis_check.check_violations.counter = 0 #to track number of powerflows
-    i = 0
-    for connect_bus in net.bus.index:
-        head = max_cap(net, connect_bus, loadorgen, upper_lim_p, low_lim_p, q, s_tol, normal_limits, contingency_limits,contingency_scenario)
-
-        headroom.loc[connect_bus] = head
-        #print progress bar
-        j = (i + 1) / n
-        sys.stdout.write('\r')
-        # the exact output you're looking for:
-        sys.stdout.write("[%-20s] %d%% (number of PFs: %d)" % ('='*int(20*j), 100*j, analysis_check.check_violations.counter))
-        sys.stdout.flush()
-        sleep(0.25)
-        i +=1
-    return headroom
\ No newline at end of file
+
+def _max_cap_margin(net, conn_at_bus, loadorgen, upper_lim_p, lower_lim_p, q, s_tol, normal_limits, contingency_limits, contingency_scenario,
+                    warm_start, method, lower_margin=None, upper_margin=None, upper_checked=False, probe=None, engine=None,
+                    upper_infeasible=False):
+    """
+    Margin driven search of max_cap, the feasible lower_lim_p and infeasible upper_lim_p bracket the max capacity.
+    Without a margin at the infeasible end, e.g. a power flow that did not converge, the next probe is
+    extrapolated from the last two probes with a margin, or halves the interval if there are none.
+    """
+    if not upper_checked:
+        upper_lim_check, net, exp, upper_margin = _check_upper(upper_infeasible, net, conn_at_bus, loadorgen, upper_lim_p, q,
+                                                               normal_limits, contingency_limits, contingency_scenario,
+                                                               warm_start, margin=True, probe=probe, engine=engine)
+        if upper_lim_check:
+            print('Max capacity is available')
+            return upper_lim_p
+    if lower_margin is None:
+        _, net, exp, lower_margin = feas_chk(net, conn_at_bus, loadorgen, lower_lim_p, q, normal_limits, contingency_limits,
+                                             contingency_scenario, warm_start, margin=True, probe=probe, engine=engine)
+
+    last_p, last_margin = upper_lim_p, upper_margin
+    prev_p, prev_margin = lower_lim_p, lower_margin
+    # probes with a margin, in the order they were checked
+    known = [(p, m) for p, m in ((lower_lim_p, lower_margin), (upper_lim_p, upper_margin)) if m is not None]
+    kept_side = 0
+    while (upper_lim_p - lower_lim_p) >= s_tol:
+        if method == 'secant':
+            test_p = _secant(prev_p, prev_margin, last_p, last_margin)
+        elif lower_margin is not None and upper_margin is not None:
+            test_p = _secant(lower_lim_p, lower_margin, upper_lim_p, upper_margin)
+        else:
+            test_p = _secant(*known[-2], *known[-1]) if len(known) >= 2 else None
+
+        if test_p is None or not lower_lim_p < test_p < upper_lim_p:
+            test_p = lower_lim_p + (upper_lim_p - lower_lim_p) / 2
+        else:
+            # keep at least half a tolerance from the interval ends so that every probe shrinks the interval
+            test_p = min(max(test_p, lower_lim_p + s_tol / 2), upper_lim_p - s_tol / 2)
+
+        test_check, net, exp, test_margin = feas_chk(net, conn_at_bus, loadorgen, test_p, q, normal_limits, contingency_limits,
+                                                     contingency_scenario, warm_start, margin=True, probe=probe, engine=engine)
+        if test_check:
+            lower_lim_p, lower_margin = test_p, test_margin
+            if method == 'illinois' and kept_side == 1 and upper_margin is not None:
+                upper_margin = upper_margin / 2
+            kept_side = 1
+        else:
+            upper_lim_p, upper_margin = test_p, test_margin
+            if method == 'illinois' and kept_side == -1 and lower_margin is not None:
+                lower_margin = lower_margin / 2
+            kept_side = -1
+        prev_p, prev_margin = last_p, last_margin
+        last_p, last_margin = test_p, test_margin
+        if test_margin is not None:
+            known.append((test_p, test_margin))
+
+    return lower_lim_p
+
+
+# Search settings of headroom
+LOW_LIM_P = 0  # min added load (MW)   ll_p
+Q_MVAR = 0
+S_TOL = 5  # tolerance in search algorithm
+
+# Result of the search at one bus, see iter_headroom
+HeadroomResult = namedtuple('HeadroomResult', ['bus', 'headroom', 'power_flows', 'elapsed', 'binding', 'loadorgen',
+                                               'binding_elements'], defaults=(None,))
+
+# Directions searched for loadorgen 'both'
+BOTH = ['load', 'sgen']
+
+
+def _directions(loadorgen):
+    return BOTH if loadorgen == 'both' else [loadorgen]
+
+
+def _headroom_columns(loadorgen):
+    """
+    Column of the headroom frame per searched direction
+    """
+    if loadorgen == 'both':
+        return {direction: 'Headroom ' + direction for direction in BOTH}
+    return {loadorgen: 'Headroom'}
+
+
+def _screen_bands(screen):
+    """
+    Bands of the contingency screen of a run, None without a screen
+    """
+    if not screen:
+        return None
+    return dict(contingency.SCREEN_BANDS, **(screen if isinstance(screen, dict) else {}))
+
+
+def _base_failures(net, contingency_scenario, contingency_limits):
+    """
+    (element, index) of the outages of contingency_scenario that fail the contingency check of the base case
+    """
+    limits = {}
+    if contingency_limits is not None:
+        limits = dict(vmax=contingency_limits['vmax'], vmin=contingency_limits['vmin'],
+                      max_line_loading=contingency_limits['max_line_loading'],
+                      max_trafo_loading=contingency_limits['max_trafo_loading'],
+                      p_lim=contingency_limits['subscription_p_limits'], run_control=contingency_limits['run_controllers'])
+    lines, trafos = analysis_check.contingency_test(net, contingency_scenario=contingency_scenario, **limits)
+    return [('line', i) for i in lines] + [('trafo', i) for i in trafos]
+
+
+def _in_service_contingencies(net, contingency_scenario):
+    """
+    Outages of contingency_scenario that are in the net and in service, the others are skipped by
+    simple_contingency_test anyway
+    """
+    line_to_test = [line_id for line_id in contingency_scenario[0]
+                    if line_id in net.line.index and net.line.at[line_id, 'in_service']]
+    trafo_to_test = [trafo_id for trafo_id in contingency_scenario[1]
+                     if trafo_id in net.trafo.index and net.trafo.at[trafo_id, 'in_service']]
+    return [line_to_test, trafo_to_test]
+
+
+class CancellationToken:
+    """
+    Stops a running iter_headroom or headroom, cancel() can be called from another thread.
+    Buses that are searched when the token is cancelled are finished, the remaining buses are skipped.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+def print_progress(event):
+    """
+    Progress callback of iter_headroom that prints a progress bar
+    """
+    j = event['done'] / event['total']
+    sys.stdout.write('\r')
+    sys.stdout.write("[%-20s] %d%% (number of PFs: %d, NR iterations: %d)" % ('='*int(20*j), 100*j, event['power_flows'],
+                                                                           event['iterations']))
+    sys.stdout.flush()
+
+
+def _radial_order(net, buses):
+    """
+    Orders buses from the ext_grid down the feeders, breadth first on the topology in service.
+
+    OUTPUT
+        order (list) - buses, the buses that are not supplied by an ext_grid last
+        parents (dict) - Nearest upstream bus in buses of every bus in order, None for the first searched bus of a feeder.
+        None, None if the topology is not radial, i.e. it has a loop or several ext_grids in one part of the net
+    """
+    graph = top.create_nxgraph(net)
+    if not len(graph) or not nx.is_forest(graph):
+        return None, None
+    slack_buses = [bus for bus in net.ext_grid.bus[net.ext_grid.in_service].values if bus in graph]
+    roots = set()
+    for slack in slack_buses:
+        root = min(nx.node_connected_component(graph, slack))
+        if root in roots:
+            return None, None
+        roots.add(root)
+
+    searched = set(buses)
+    order, parents, upstream = [], {}, {}
+    for slack in slack_buses:
+        upstream[slack] = None
+        for bus, predecessor in [(slack, None)] + list(nx.bfs_predecessors(graph, slack)):
+            if predecessor is not None:
+                upstream[bus] = predecessor if predecessor in searched else upstream[predecessor]
+            if bus in searched:
+                order.append(bus)
+                parents[bus] = upstream[bus]
+    for bus in buses:
+        if bus not in parents:
+            order.append(bus)
+            parents[bus] = None
+    return order, parents
+
+
+def _bus_headroom(net, connect_bus, loadorgen, upper_lim_p, low_lim_p, q, s_tol, normal_limits, contingency_limits, contingency_scenario,
+                  warm_start, warm_controllers, base_state, base_margin, method, guesses, probe, cache, cache_key, engine,
+                  upper_infeasible=False):
+    """
+    Runs the capacity search for one bus, starting from the initial controller state and a full collapse budget
+    of the solver ladder so that the result does not depend on which buses were searched before on the same net.
+    With warm_start the first probe starts from base_state and later probes from the previous probe,
+    with warm_controllers also the controllers of every check of the bus after the first, see WarmStart.
+    base_margin (float) - Margin of the base case without the probe from feas_chk or None, see max_cap lower_margin
+    guesses (Series) - Predicted headroom per bus or None
+    probe (int) - Index of the probe from create_probe used for the search
+    cache, cache_key - Cache for the bus results and key of the study, see max_cap
+    engine (ContingencyEngine) - Contingency engine of the run or None, see max_cap
+    upper_infeasible (bool) - upper_lim_p is above the infeasible end of the upstream bus, see max_cap
+
+    OUTPUT
+        result (HeadroomResult) - Headroom with the power flows and time of the search and the
+                                  violation above the headroom as text and as violated elements,
+                                  None if the full upper_lim_p is available
+    """
+    start = perf_counter()
+    no_pf = analysis_check.check_violations.power_flows
+    feas_chk.binding = None
+    feas_chk.binding_elements = None
+    reset_all_controllers(net)
+    analysis_check.solver_ladder.reset()
+    bus_warm_start = WarmStart(base_state, warm_controllers) if warm_start else None
+    guess = None if guesses is None else guesses.get(connect_bus)
+    head = max_cap(net, connect_bus, loadorgen, upper_lim_p, low_lim_p, q, s_tol, normal_limits, contingency_limits, contingency_scenario,
+                   bus_warm_start, method, guess, probe=probe, cache=cache, cache_key=cache_key, engine=engine,
+                   lower_margin=base_margin, upper_infeasible=upper_infeasible)
+    binding = feas_chk.binding if head < upper_lim_p else None
+    elements = feas_chk.binding_elements if head < upper_lim_p else None
+    return HeadroomResult(connect_bus, head, analysis_check.check_violations.power_flows - no_pf, perf_counter() - start, binding,
+                          loadorgen, elements)
+
+
+# Base net and search settings per direction of a headroom worker process, shipped once by the pool initializer
+_worker_net = None
+_worker_search_args = None
+
+
+def _init_headroom_worker(net, search_args):
+    global _worker_net, _worker_search_args
+    _worker_net = net
+    _worker_search_args = search_args
+
+
+def _with_upper(search_args, upper_lim_p):
+    return search_args[:1] + (upper_lim_p,) + search_args[2:]
+
+
+def _headroom_worker(connect_bus, loadorgen, upper_lim_p, upper_infeasible=False):
+    """
+    Searches headroom for one bus and direction up to upper_lim_p on the worker's own copy of the net,
+    see _bus_headroom for upper_infeasible.
+
+    OUTPUT
+        result (HeadroomResult) - See _bus_headroom
+        counters (dict) - Power flow statistics of the search, see analysis_check.get_counters
+        pruning_errors (list) - Pruning errors of the search, see contingency.ContingencyEngine
+    """
+    analysis_check.reset_counters()
+    engine = _worker_search_args[loadorgen][-1]
+    if engine is not None:
+        del engine.pruning_errors[:]
+    result = _bus_headroom(_worker_net, connect_bus, *_with_upper(_worker_search_args[loadorgen], upper_lim_p),
+                           upper_infeasible=upper_infeasible)
+    return result, analysis_check.get_counters(), [] if engine is None else list(engine.pruning_errors)
+
+
+def iter_headroom(net, loadorgen, upper_lim_p, normal_limits=None, contingency_limits=None, contingency_scenario=[[],[]], workers=None,
+                  warm_start=True, method='bisection', predict=False, cache=None, buses=None, guesses=None, progress=None, cancel=None,
+                  order=None, screen=False, fail_fast=False, islanding=True, prune=None, validate=False,
+                  warm_controllers=False):
+    """
+    Calculates the headroom bus by bus and yields every result as soon as it is found, see headroom for the parameters.
+    With loadorgen 'both' the load and the sgen headroom of a bus are searched one after the other on the same
+    base case, base state and contingency list.
+
+    INPUT
+        progress (callable) - Called after every search with a dict with the keys done, total, bus, power_flows,
+                              iterations and elapsed, the power flows and time of the run so far. See print_progress.
+        cancel (CancellationToken) - Stops the run when cancelled, no further buses are searched
+        order (str) - 'topology' to search radial nets from the ext_grid down the feeders. A bus never has more headroom
+                      than its upstream bus, so the search of a bus is limited to the upstream headroom + s_tol and
+                      skipped when that leaves less than s_tol. Nets that are not radial are searched in the order of buses.
+        screen (bool or dict) - Screen the outages of contingency_scenario with outage distribution factors of the base case,
+                                only outages close to a limit are checked with AC power flows. A dict sets the bands
+                                of the screen, see contingency.ContingencyEngine.
+        fail_fast (bool) - Test first the outages that failed most checks so far in the run, so that a probe that is not
+                           feasible usually stops after one or two contingency power flows. With workers every
+                           worker learns the order from its own searches.
+        islanding (bool) - Outages that cut a load bus, or the load probe, off from the supply fail without a power flow.
+                           The islanded buses of every outage are found once from the topology of the net.
+        prune (float) - Skip the outages of branches that carry less than this share of the capacity at the searched bus
+                        in a DC power flow of the base case, e.g. 0.01. Outages in other feeders of a radial net carry none.
+        validate (bool) - With prune, also test the skipped outages when all others pass. The result is then the same as
+                          without pruning and every check where pruning would have changed the result is kept as
+                          (bus, element, index) in iter_headroom.pruning_errors.
+        warm_controllers (bool) - With warm_start, also start the controllers of every check of a bus from the positions
+                                  of the previous converged check of the bus with the same topology, the intact net or
+                                  the same outage. Each bus starts from the initial controller state.
+
+    OUTPUT
+        generator of HeadroomResult (bus, headroom, power_flows, elapsed, binding, loadorgen, binding_elements).
+        With workers the results come in the order they are finished.
+    """
+    pruning_errors = iter_headroom.pruning_errors = []
+    low_lim_p, q, s_tol = LOW_LIM_P, Q_MVAR, S_TOL
+    guided = predict or guesses is not None
+    if buses is None:
+        buses = net.bus.index
+    directions = _directions(loadorgen)
+    if loadorgen != 'both':
+        guesses = {loadorgen: guesses}
+    elif guesses is None:
+        guesses = {}
+    parents = {}
+    if order == 'topology':
+        radial_buses, radial_parents = _radial_order(net, buses)
+        if radial_buses is None:
+            print('Net is not radial, buses are searched in the given order')
+        else:
+            buses, parents = radial_buses, radial_parents
+    tasks = [(connect_bus, direction) for connect_bus in buses for direction in directions]
+    n = len(tasks)
+    start = perf_counter()
+
+    cache_keys = {direction: None for direction in directions}
+    if cache is not None:
+        reset_all_controllers(net)
+        net_hash = headroom_cache.net_key(net)
+        for direction in directions:
+            cache_keys[direction] = _bus_cache_key(net_hash, direction, low_lim_p, q, s_tol, normal_limits,
+                                                   contingency_limits, contingency_scenario, _screen_bands(screen),
+                                                   None if validate else prune, warm_start and warm_controllers,
+                                                   method, guided, order, warm_start)
+    contingency_scenario = _in_service_contingencies(net, contingency_scenario)
+
+    def report(done, connect_bus):
+        if progress is not None:
+            counters = analysis_check.get_counters()
+            progress({'done': done, 'total': n, 'bus': connect_bus, 'power_flows': counters['power_flows'],
+                      'iterations': counters['iterations'], 'elapsed': perf_counter() - start})
+
+    # one probe per direction for all checks, created before the base case so that they are part of the results tables
+    probes = {}
+    try:
+        for direction in directions:
+            probes[direction] = create_probe(net, direction)
+
+        base_failures = None
+        if prune is not None:
+            # outages that fail without added capacity are never pruned
+            base_failures = _base_failures(net, contingency_scenario, contingency_limits)
+
+        base_state = None
+        if warm_start or predict or screen or prune is not None:
+            try:
+                pp.runpp(net)
+                base_state = analysis_check.get_pf_state(net)
+            except pp.LoadflowNotConverged:
+                pass
+
+        engine = None
+        if base_state is None:
+            # screen and pruning need the results of the base case
+            screen, prune = False, None
+        if screen or fail_fast or (islanding and any(contingency_scenario)) or prune is not None:
+            # one screen and test order of the outages for the run, shared by both directions
+            engine = contingency.ContingencyEngine(net, contingency_scenario, screen=bool(screen), bands=_screen_bands(screen),
+                                                   fail_fast=fail_fast, islanding=islanding, prune=prune, validate=validate,
+                                                   base_failures=base_failures)
+            if workers is None or workers <= 1:
+                iter_headroom.pruning_errors = pruning_errors = engine.pruning_errors
+
+        if predict and base_state is not None and any(guesses.get(d) is None for d in directions):
+            # one factorization of the base case for both directions
+            sens = sensitivity.injection_sensitivities(net)
+            for direction in directions:
+                if guesses.get(direction) is None:
+                    guesses[direction] = sensitivity.predict_headroom(net, direction, upper_lim_p, normal_limits, sens=sens)
+        if not warm_start:
+            base_state = None
+
+        analysis_check.reset_counters() #to track number of powerflows
+        base_margins = {direction: None for direction in directions}
+        if method != 'bisection' and low_lim_p == 0 and q == 0 and tasks:
+            # the margin without added capacity is the same at every bus, the margin methods start from it
+            for direction in directions:
+                reset_all_controllers(net)
+                _, net, _, base_margins[direction] = feas_chk(
+                    net, tasks[0][0], direction, low_lim_p, q, normal_limits, contingency_limits, contingency_scenario,
+                    WarmStart(base_state), margin=True, probe=probes[direction],
+                    engine=engine)
+        search_args = {direction: (direction, upper_lim_p, low_lim_p, q, s_tol, normal_limits, contingency_limits,
+                                   contingency_scenario, warm_start, warm_start and warm_controllers, base_state,
+                                   base_margins[direction], method, guesses.get(direction),
+                                   probes[direction], cache, cache_keys[direction], engine)
+                       for direction in directions}
+
+        heads = {}
+
+        def search_upper(connect_bus, direction):
+            # upper limit of the search from the upstream headroom, None while the upstream bus is searched
+            parent = parents.get(connect_bus)
+            if parent is None:
+                return upper_lim_p
+            if (parent, direction) not in heads:
+                return None
+            return min(upper_lim_p, heads[parent, direction] + s_tol)
+
+        def collapsed(connect_bus, direction, upper):
+            if upper >= upper_lim_p or upper - low_lim_p > s_tol:
+                return None
+            return HeadroomResult(connect_bus, low_lim_p, 0, 0., 'upstream bus %s' % parents[connect_bus], direction)
+
+        done = 0
+        if workers is None or workers <= 1:
+            # tasks are in topological order, the upstream bus is always searched first
+            for connect_bus, direction in tasks:
+                if cancel is not None and cancel.cancelled:
+                    return
+                upper = search_upper(connect_bus, direction)
+                result = collapsed(connect_bus, direction, upper)
+                if result is None:
+                    # below the full upper limit the upper end is above the infeasible end of the upstream bus
+                    result = _bus_headroom(net, connect_bus, *_with_upper(search_args[direction], upper),
+                                           upper_infeasible=upper < upper_lim_p)
+                heads[connect_bus, direction] = result.headroom
+                done += 1
+                report(done, connect_bus)
+                yield result
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_headroom_worker, initargs=(net, search_args)) as pool:
+            waiting, running = list(tasks), set()
+            try:
+                while waiting or running:
+                    # submit every task whose upstream bus is done, collapsed searches are finished right away
+                    ready = []
+                    for task in waiting:
+                        upper = search_upper(*task)
+                        if upper is None:
+                            continue
+                        ready.append(task)
+                        result = collapsed(*task, upper)
+                        if result is None:
+                            running.add(pool.submit(_headroom_worker, *task, upper, upper < upper_lim_p))
+                        else:
+                            heads[task] = result.headroom
+                            done += 1
+                            report(done, result.bus)
+                            yield result
+                    waiting = [task for task in waiting if task not in ready]
+                    if not running:
+                        continue
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        result, counters, errors = future.result()
+                        analysis_check.add_counters(counters)
+                        pruning_errors.extend(errors)
+                        heads[result.bus, result.loadorgen] = result.headroom
+                        done += 1
+                        report(done, result.bus)
+                        yield result
+                    if cancel is not None and cancel.cancelled:
+                        return
+            finally:
+                # buses not started yet are dropped, e.g. when cancelled or the generator is closed
+                for future in running:
+                    future.cancel()
+    finally:
+        for direction, probe in probes.items():
+            remove_probe(net, direction, probe)
+
+iter_headroom.pruning_errors = []
+
+
+def headroom(net, loadorgen, upper_lim_p,normal_limits = None, contingency_limits=None,contingency_scenario=[[],[]], workers=None,
+             warm_start=True, method='bisection', predict=False, cache=None, buses=None, guesses=None, progress=print_progress,
+             cancel=None, order=None, screen=False, fail_fast=False, islanding=True, prune=None, validate=False,
+             warm_controllers=False):
+    """
+    Calculates the available capacity (headroom) at every bus in the net.
+
+    INPUT
+        net (PP net) - Pandapower net
+        loadorgen (str) - 'sgen' or 'load' for generation or load for additional capacity connected,
+                          'both' for load and generation hosting in one run
+        upper_lim_p (float) - Max capacity to test (MW)
+        normal_limits (dict) - Limits for normal operation, default limits of check_violations if None
+        contingency_limits (dict) - Limits for contingencies, default limits of simple_contingency_test if None
+        contingency_scenario (list) - [lines to test, trafos to test]
+        workers (int) - Number of worker processes. If None or 1 the buses are searched in this process,
+                        otherwise the net is shipped once to a process pool and the buses are split between the workers.
+                        Every bus starts from the initial controller state, so the result is the same in both modes.
+        warm_start (bool) - Start the power flows of a bus search from the previous converged probe of the bus,
+                            and the first probe from the base case, instead of a flat start.
+                            Warm starts that diverge are rerun from a flat start.
+        method (str) - Search method of max_cap, 'bisection', 'secant', 'regula_falsi' or 'illinois'
+        predict (bool) - Predict the headroom of all buses from linear sensitivities of the base case
+                         (see sensitivity.predict_headroom) and only verify a narrow interval around
+                         the prediction with AC power flows
+        cache (HeadroomCache) - Cache on disk, see headroom_cache. A study on an unchanged net with the same
+                                loadorgen, upper_lim_p, limits and contingency_scenario returns the stored result,
+                                otherwise the stored results of single buses are reused where valid.
+        buses (list) - Buses to search, all buses in net.bus if None
+        guesses (Series) - Start values of the search per bus, e.g. a previous result, see max_cap guess.
+                           Takes precedence over predict. A dict of Series with the keys 'load' and 'sgen' for 'both'.
+        progress (callable) - Progress callback, see iter_headroom. Prints a progress bar by default.
+        cancel (CancellationToken) - Stops the run when cancelled, the buses found so far are returned
+        order (str) - 'topology' to search radial nets from the ext_grid down the feeders, see iter_headroom
+        screen (bool or dict) - Screen the outages with outage distribution factors and only run AC power flows
+                                for the outages close to a limit, see iter_headroom
+        fail_fast (bool) - Test the outages that fail most often in the run first, see iter_headroom
+        islanding (bool) - Fail outages that island load from the topology without a power flow, see iter_headroom
+        prune (float) - Skip the outages that carry less than this share of the capacity at the searched bus, see iter_headroom
+        validate (bool) - With prune, report the checks where pruning would have changed the result, see iter_headroom
+        warm_controllers (bool) - Start the controllers from the previous converged check of the bus, see iter_headroom
+
+    OUTPUT
+        headroom (DataFrame) - Headroom (MW) per bus, index as net.bus or buses. Column "Headroom",
+                               for 'both' the columns "Headroom load" and "Headroom sgen".
+                               The elements of the binding constraints per bus are kept in headroom.attrs['binding']
+                               as {bus: {element table: set of indices}}, see update_headroom.
+    """
+    if buses is None:
+        buses = net.bus.index
+
+    if cache is not None:
+        reset_all_controllers(net)
+        cache_key = _bus_cache_key(headroom_cache.net_key(net), loadorgen, LOW_LIM_P, Q_MVAR, S_TOL, normal_limits,
+                                   contingency_limits, contingency_scenario, _screen_bands(screen),
+                                   None if validate else prune, warm_start and warm_controllers,
+                                   method, predict or guesses is not None, order, warm_start)
+        frame_key = headroom_cache.study_key(cache_key, upper_lim_p=upper_lim_p, buses=list(buses),
+                                             guesses=_guesses_key(guesses))
+        cached = cache.get_headroom(frame_key)
+        if cached is not None:
+            return cached
+
+    columns = _headroom_columns(loadorgen)
+    heads = {}
+    binding = {}
+    for result in iter_headroom(net, loadorgen, upper_lim_p, normal_limits=normal_limits, contingency_limits=contingency_limits,
+                                contingency_scenario=contingency_scenario, workers=workers, warm_start=warm_start, method=method,
+                                predict=predict, cache=cache, buses=buses, guesses=guesses, progress=progress, cancel=cancel,
+                                order=order, screen=screen, fail_fast=fail_fast, islanding=islanding, prune=prune,
+                                validate=validate, warm_controllers=warm_controllers):
+        heads.setdefault(result.bus, {})[columns[result.loadorgen]] = result.headroom
+        if result.binding_elements:
+            elements = binding.setdefault(result.bus, {})
+            for element, idx in result.binding_elements.items():
+                elements.setdefault(element, set()).update(idx)
+    if validate and iter_headroom.pruning_errors:
+        print('Pruning would have changed %d checks at the buses %s, see iter_headroom.pruning_errors'
+              % (len(iter_headroom.pruning_errors), sorted(set(bus for bus, _, _ in iter_headroom.pruning_errors))))
+
+    headroom = pd.DataFrame(columns=list(columns.values()))
+    for connect_bus in buses:
+        if connect_bus in heads:
+            headroom.loc[connect_bus] = pd.Series(heads[connect_bus])
+    headroom.attrs['binding'] = binding
+    if cache is not None and sum(len(h) for h in heads.values()) == len(buses) * len(columns):
+        cache.put_headroom(frame_key, headroom)
+    return headroom
+
+
+# terminal bus columns of the elements that can be changed
+_TERMINALS = {'line': ['from_bus', 'to_bus'], 'trafo': ['hv_bus', 'lv_bus'], 'trafo3w': ['hv_bus', 'mv_bus', 'lv_bus'],
+              'switch': ['bus'], 'load': ['bus'], 'sgen': ['bus'], 'gen': ['bus'], 'shunt': ['bus'], 'ext_grid': ['bus']}
+
+
+def _supplied_buses(graph, slack_buses):
+    supplied = set()
+    for slack in slack_buses:
+        if slack in graph and slack not in supplied:
+            supplied.update(nx.node_connected_component(graph, slack))
+    return supplied
+
+
+def affected_buses(net, changes, depth=2, binding=None):
+    """
+    Buses whose headroom can be affected by a change of the net: the buses within depth branches of
+    a changed element, the buses that are only supplied through a terminal bus of a changed element
+    and the buses whose binding constraint is a changed element or a terminal bus of one.
+
+    INPUT
+        net (PP net) - Pandapower net
+        changes (dict) - Changed elements, element table as key and list of indices as value,
+                         e.g. {'line': [3], 'trafo': [1]} for a changed rating or in_service
+        depth (int) - Number of branches around a change that are affected
+        binding (dict) - Elements of the binding constraint per bus, e.g. headroom.attrs['binding'] of the
+                         previous result, the violated elements and the outage of a failing contingency
+
+    OUTPUT
+        buses (list) - Affected buses in the order of net.bus
+    """
+    terminals = set()
+    for element, idx in changes.items():
+        if element == 'bus':
+            terminals.update(idx)
+            continue
+        for column in _TERMINALS.get(element, []):
+            terminals.update(net[element].loc[idx, column].values)
+        if element == 'switch':
+            bus_switches = net.switch.loc[idx]
+            terminals.update(bus_switches.element[bus_switches.et == 'b'].values)
+
+    # the topology in service, with the changed branches connected so that the change is inside the graph
+    graph = top.create_nxgraph(net)
+    for element in ('line', 'trafo'):
+        if element in changes:
+            columns = _TERMINALS[element]
+            for from_bus, to_bus in net[element].loc[changes[element], columns].values:
+                graph.add_edge(from_bus, to_bus)
+    affected = set(terminals)
+    for bus in terminals:
+        if bus in graph:
+            affected.update(nx.single_source_shortest_path_length(graph, bus, cutoff=depth).keys())
+
+    # buses that are supplied through a terminal bus as seen from the ext_grid
+    slack_buses = set(net.ext_grid.bus[net.ext_grid.in_service].values)
+    supplied = _supplied_buses(graph, slack_buses)
+    for bus in terminals - slack_buses:
+        if bus not in supplied:
+            continue
+        reduced = graph.copy()
+        reduced.remove_node(bus)
+        affected.update(supplied - _supplied_buses(reduced, slack_buses) - {bus})
+
+    # buses limited by a changed element, wherever it is in the net
+    if binding:
+        changed = {('bus', bus) for bus in terminals}
+        changed.update((element, i) for element, idx in changes.items() for i in idx)
+        for bus, elements in binding.items():
+            if any((element, i) in changed for element, idx in elements.items() for i in idx):
+                affected.add(bus)
+
+    return [bus for bus in net.bus.index if bus in affected]
+
+
+def update_headroom(net, previous, changes, loadorgen, upper_lim_p, normal_limits=None, contingency_limits=None,
+                    contingency_scenario=[[],[]], depth=2, **kwargs):
+    """
+    Recalculates a headroom result after a change of the net, only the buses from affected_buses are searched again,
+    including the buses whose binding constraint in previous.attrs['binding'] touches a changed element.
+    Their search starts around the previous headroom, see max_cap guess.
+
+    INPUT
+        net (PP net) - Pandapower net with the change applied
+        previous (DataFrame) - Headroom of the net before the change, from headroom()
+        changes (dict) - Changed elements, see affected_buses
+        loadorgen, upper_lim_p, normal_limits, contingency_limits, contingency_scenario - As for the previous result
+        depth (int) - See affected_buses
+        **kwargs - Further options of headroom(), e.g. workers
+
+    OUTPUT
+        headroom (DataFrame) - Headroom (MW) per bus, index as net.bus, with the binding constraints in attrs['binding']
+    """
+    columns = _headroom_columns(loadorgen)
+    binding = previous.attrs.get('binding', {})
+    buses = set(affected_buses(net, changes, depth, binding))
+    updated = previous.reindex(net.bus.index)
+    # buses without a previous result are searched as well
+    missing = updated[list(columns.values())].isna().any(axis=1)
+    buses = [bus for bus in net.bus.index if bus in buses or missing.at[bus]]
+    if len(buses):
+        guesses = {direction: previous[column] for direction, column in columns.items()}
+        if loadorgen != 'both':
+            guesses = guesses[loadorgen]
+        changed = headroom(net, loadorgen, upper_lim_p, normal_limits=normal_limits, contingency_limits=contingency_limits,
+                           contingency_scenario=contingency_scenario, buses=buses, guesses=guesses, **kwargs)
+        for column in columns.values():
+            updated.loc[buses, column] = changed[column]
+        binding = {bus: elements for bus, elements in binding.items() if bus not in changed.index}
+        binding.update(changed.attrs.get('binding', {}))
+    updated.attrs['binding'] = binding
+    return updated
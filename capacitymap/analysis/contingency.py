@@ -0,0 +1,491 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+"""
+Contingency engine for analysis_check.simple_contingency_test. Screens the outages of a contingency
+scenario with linear outage distribution factors so that only the outages with an uncertain result
+are checked with AC power flows, flags outages that cut load off from the supply from the topology
+alone, and keeps the outages that fail most often in a run at the front
+of the test order. Also enumerates the N-2 pairs and the maintenance configurations of a Grid.
+"""
+
+from collections import Counter
+from itertools import combinations
+import numpy as np
+import networkx as nx
+import pandapower.topology as top
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu
+from pandapower.pypower.idx_bus import BUS_TYPE, REF, NONE
+from pandapower.pypower.idx_brch import F_BUS, T_BUS, BR_X, TAP, BR_STATUS
+from capacitymap.analysis import sensitivity
+
+# Classes of the screened outages
+SAFE = 'safe'
+VIOLATING = 'violating'
+CHECK = 'check'
+
+# Default uncertainty bands of the screen, outages within a band of a limit are checked with AC power flows
+SCREEN_BANDS = {'loading': 10., 'vm': 0.01, 'p': 0.05}
+
+# Terminal bus columns of the outaged branches, from side first as in the ppc
+_BRANCH_BUSES = {'line': ('from_bus', 'to_bus'), 'trafo': ('hv_bus', 'lv_bus')}
+_BRANCH_FLOWS = {'line': ('p_from_mw', 'q_from_mvar'), 'trafo': ('p_hv_mw', 'q_hv_mvar')}
+
+
+def _branch_rows(net, element):
+    """
+    Rows of the elements of net[element] in the branch matrix of net._ppc
+    """
+    lookup = net._pd2ppc_lookups['branch']
+    if element not in lookup:
+        return np.zeros(0, dtype=int)
+    start, _ = lookup[element]
+    return start + np.arange(len(net[element]))
+
+
+def _ratings(net):
+    """
+    Rated apparent power (MVA) of the lines and trafos that is 100 % loading
+    """
+    vn_kv = net.bus.vn_kv.loc[net.line.from_bus].values
+    line = np.sqrt(3) * vn_kv * net.line.max_i_ka.values * net.line.df.values * net.line.parallel.values
+    trafo = net.trafo.sn_mva.values * net.trafo.parallel.values
+    return {'line': line, 'trafo': trafo}
+
+
+def _dc_transfers(net, rows):
+    """
+    DC power flow of the converged net for a transfer of 1 MW from the from bus to the to bus of each ppc branch in rows
+
+    OUTPUT
+        f, t (array) - From and to bus of every ppc branch
+        b (array) - Susceptance of every ppc branch, 0 for branches out of service
+        supplied (array) - True for the ppc buses supplied from a reference bus
+        Bf (sparse) - Flow of every ppc branch per radian of bus angle
+        free (array) - Supplied ppc buses that are not reference buses
+        theta (array) - Angles of the free buses per transfer, one column per row, None without free buses or rows
+    """
+    ppc = net._ppc
+    bus, branch = ppc['bus'], ppc['branch']
+    n_bus, n_branch = len(bus), len(branch)
+    f = branch[:, F_BUS].real.astype(int)
+    t = branch[:, T_BUS].real.astype(int)
+    x = branch[:, BR_X].real
+    tap = branch[:, TAP].real
+    tap[tap == 0] = 1.
+    on = (branch[:, BR_STATUS].real > 0) & (x != 0)
+    b = np.where(on, 1. / np.where(x != 0, x * tap, 1.), 0.)
+
+    # buses that are supplied from a reference bus
+    active = bus[:, BUS_TYPE] != NONE
+    adjacency = csr_matrix((np.ones(on.sum()), (f[on], t[on])), shape=(n_bus, n_bus))
+    _, component = connected_components(adjacency, directed=False)
+    ref = (bus[:, BUS_TYPE] == REF) & active
+    supplied = active & np.isin(component, component[ref])
+    free = np.flatnonzero(supplied & ~ref)
+    pos = np.full(n_bus, -1)
+    pos[free] = np.arange(len(free))
+
+    branch_idx = np.arange(n_branch)
+    Bf = csr_matrix((np.r_[b, -b], (np.r_[branch_idx, branch_idx], np.r_[f, t])), shape=(n_branch, n_bus))
+    Cft = csr_matrix((np.r_[np.ones(n_branch), -np.ones(n_branch)], (np.r_[branch_idx, branch_idx], np.r_[f, t])),
+                     shape=(n_branch, n_bus))
+    Bbus = (Cft.T @ Bf).tocsc()
+
+    rhs = np.zeros((len(free), len(rows)))
+    cols = np.arange(len(rows))
+    fo, to = pos[f[rows]], pos[t[rows]]
+    rhs[fo[fo >= 0], cols[fo >= 0]] += 1.
+    rhs[to[to >= 0], cols[to >= 0]] -= 1.
+    theta = None
+    if len(free) and len(rows):
+        theta = splu(Bbus[free][:, free].tocsc()).solve(rhs)
+    return f, t, b, supplied, Bf, free, theta
+
+
+def distribution_factors(net, rows):
+    """
+    Line outage distribution factors of the DC power flow of the converged net for the outage of the ppc branches in rows.
+
+    INPUT
+        net (PP net) - Pandapower net with the results of a power flow
+        rows (array) - Rows of the outaged branches in net._ppc['branch']
+
+    OUTPUT
+        lodf (array) - Change of the flow of every ppc branch per MW of pre-outage flow on the outaged branch,
+                       one column per outage, -1 for the outaged branch itself. NaN columns for outages that
+                       split the net.
+        transfer (array) - Flow from the from bus to the to bus of every outage that moves the pre-outage flow
+                           (compensation injection) per MW of pre-outage flow, NaN for outages that split the net
+    """
+    rows = np.asarray(rows, dtype=int)
+    cols = np.arange(len(rows))
+    f, t, _, supplied, Bf, free, theta = _dc_transfers(net, rows)
+    ptdf = np.zeros((len(f), len(rows)))
+    if theta is not None:
+        ptdf = Bf[:, free] @ theta
+
+    self_ptdf = ptdf[rows, cols]
+    islanding = (1. - self_ptdf < 1e-6) | ~supplied[f[rows]] | ~supplied[t[rows]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        transfer = np.where(islanding, np.nan, 1. / (1. - self_ptdf))
+    lodf = ptdf * transfer
+    lodf[rows, cols] = -1.
+    return lodf, transfer
+
+
+def injection_shares(net, rows):
+    """
+    Share of an injection at every bus that flows over each of the ppc branches in rows, in the DC power flow
+    of the converged net with the injection taken by the reference buses. An outage of a branch that carries
+    no share of the injection at a bus does not change how the injection spreads over the net.
+
+    INPUT
+        net (PP net) - Pandapower net with the results of a power flow
+        rows (array) - Rows of the outaged branches in net._ppc['branch']
+
+    OUTPUT
+        shares (array) - Absolute flow (MW) on every outaged branch per MW injected, one row per ppc bus and
+                         one column per outage, 0 for reference buses and buses that are not supplied
+    """
+    rows = np.asarray(rows, dtype=int)
+    _, _, b, _, _, free, theta = _dc_transfers(net, rows)
+    shares = np.zeros((len(net._ppc['bus']), len(rows)))
+    if theta is not None:
+        # Bbus is symmetric, so the angles of the transfer over a branch give the flow on it per injection at every bus
+        shares[free] = np.abs(theta * b[rows][None, :])
+    return shares
+
+
+def _slack_buses(net):
+    slack = set(net.ext_grid.bus[net.ext_grid.in_service].values)
+    if 'slack' in net.gen:
+        slack.update(net.gen.bus[net.gen.in_service & net.gen.slack.fillna(False).astype(bool)].values)
+    return slack
+
+
+def _supplied(graph, slack_buses):
+    supplied = set()
+    for slack in slack_buses:
+        if slack in graph and slack not in supplied:
+            supplied.update(nx.node_connected_component(graph, slack))
+    return supplied
+
+
+def islanded_buses(net, outages):
+    """
+    Buses that are cut off from every slack (ext_grid or slack gen) by each outage, from the bridges of the
+    topology in service.
+
+    INPUT
+        net (PP net) - Pandapower net
+        outages (list) - (element, index) of the outaged lines and trafos
+
+    OUTPUT
+        islanded (list) - Array of the cut off buses per outage, empty for outages that do not split the
+                          supplied part of the net
+    """
+    graph = top.create_nxgraph(net)
+    # parallel branches are never bridges, so the bridges of the simple graph with one branch are enough
+    parallel = Counter(frozenset((u, v)) for u, v in graph.edges())
+    simple = nx.Graph(graph)
+    simple.remove_edges_from(nx.selfloop_edges(simple))
+    bridges = {frozenset(edge) for edge in nx.bridges(simple)}
+    slack_buses = _slack_buses(net)
+    supplied = _supplied(simple, slack_buses)
+
+    islanded = []
+    for element, i in outages:
+        u, v = net[element].loc[i, list(_BRANCH_BUSES[element])].values
+        edge = frozenset((u, v))
+        if edge not in bridges or parallel[edge] != 1 or u not in supplied:
+            islanded.append(np.zeros(0, dtype=int))
+            continue
+        simple.remove_edge(u, v)
+        # the side of the bridge without a slack is cut off
+        cut = nx.node_connected_component(simple, v if v not in _supplied(simple, slack_buses) else u)
+        simple.add_edge(u, v)
+        islanded.append(np.fromiter(cut, dtype=int))
+    return islanded
+
+
+def pair_coupling(net, outages):
+    """
+    Coupling of the outages of a pair in the DC power flow of the converged net, a pair of weakly coupled outages
+    changes the flows about as much as the two outages one at a time.
+
+    INPUT
+        net (PP net) - Pandapower net with the results of a power flow
+        outages (list) - (element, index) of outaged lines and trafos that are in service
+
+    OUTPUT
+        coupling (array) - Share of the pre-outage flow of outage j that moves to the branch of outage i in row i
+                           and column j, NaN for outages that split the net
+    """
+    rows = {element: _branch_rows(net, element) for element in _BRANCH_BUSES}
+    outage_rows = np.array([rows[element][net[element].index.get_loc(i)] for element, i in outages], dtype=int)
+    lodf, _ = distribution_factors(net, outage_rows)
+    return np.abs(lodf[outage_rows])
+
+
+def outage_pairs(outages, pairs=None):
+    """
+    N-2 pairs of outages, all pairs of outages if pairs is None, otherwise the given pairs
+    of ((element, index), (element, index)) that only contain outages in outages
+    """
+    if pairs is None:
+        return list(combinations(outages, 2))
+    outages = set(outages)
+    return [(tuple(first), tuple(second)) for first, second in pairs
+            if tuple(first) in outages and tuple(second) in outages and tuple(first) != tuple(second)]
+
+
+def maintenance_configs(grid, days=None):
+    """
+    Configurations of the net during the planned work in grid.config_dict, days with the same changes are grouped
+    so that every configuration is studied once.
+
+    INPUT
+        grid (Grid) - Grid with the planned projects
+        days (list) - Days to study, all days of grid.config_dict if None. Days without planned changes
+                      are studied in normal operation.
+
+    OUTPUT
+        configs (list) - (config, days) per configuration, config as a list of changes of grid.config_dict
+    """
+    if days is None:
+        days = sorted(grid.config_dict.keys())
+    groups = {}
+    for day in days:
+        config = grid.config_dict.get(day, [])
+        if isinstance(config, dict):
+            config = [config]
+        key = tuple(sorted((c['Object_type'], str(c['ObjectID']), bool(c['Status'])) for c in config))
+        groups.setdefault(key, (config, []))[1].append(day)
+    return list(groups.values())
+
+
+class ContingencyEngine:
+    """
+    Outages of a contingency scenario with a linear screen of their post-outage state, built once per configuration
+    of the net and reused for every check of a headroom run, see analysis_check.simple_contingency_test.
+
+    The screen estimates the post-outage branch flows with line outage distribution factors and the bus voltages
+    with the injection sensitivities of the base case (see sensitivity.injection_sensitivities), starting from the
+    results of the intact case that is checked. Outages whose estimate is within bands of all limits are safe,
+    outages whose estimate breaks a limit by more than the band are violating, the others need an AC check.
+
+    INPUT
+        net (PP net) - Pandapower net with the results of a converged power flow of the base case
+        contingency_scenario (list) - [lines to test, trafos to test]
+        screen (bool) - Screen the outages, otherwise every outage needs an AC check
+        bands (dict) - Uncertainty bands of the screen: 'loading' (percent points), 'vm' (pu) and
+                       'p' (share of the subscription limit of the ext_grid), see SCREEN_BANDS
+        fail_fast (bool) - Learn which outages fail the checks of the run and test them first, see order
+        islanding (bool) - Outages that cut a load bus off from the supply fail without a power flow,
+                           the islanded buses of every outage are taken from the topology once, see islanded_buses
+        prune (float) - Skip the outages of branches that carry less than this share of an injection at the probe bus,
+                        see injection_shares and groups. None to test all outages. Outages that island load or fail
+                        the base case are never skipped.
+        validate (bool) - With prune, test the skipped outages after the others and record in pruning_errors every
+                          check where only a skipped outage fails, i.e. where pruning would have changed the result
+        base_failures (list) - (element, index) of the outages that fail the contingency check of the base case
+                               without added capacity, never skipped by prune
+    """
+
+    def __init__(self, net, contingency_scenario, screen=True, bands=None, fail_fast=False, islanding=True, prune=None,
+                 validate=False, base_failures=None):
+        self.outages = [('line', line_id) for line_id in contingency_scenario[0]
+                        if line_id in net.line.index and net.line.at[line_id, 'in_service']]
+        self.outages += [('trafo', trafo_id) for trafo_id in contingency_scenario[1]
+                         if trafo_id in net.trafo.index and net.trafo.at[trafo_id, 'in_service']]
+        self.bands = dict(SCREEN_BANDS, **(bands or {}))
+        # outages per class of the linear screen, outages found to island load from the topology and pruned outages
+        self.stats = {SAFE: 0, VIOLATING: 0, CHECK: 0, 'islanding': 0, 'pruned': 0}
+        self.fail_fast = fail_fast
+        # failed checks per outage and number of the last failed check of the run, -1 if none
+        self.failures = np.zeros(len(self.outages), dtype=int)
+        self.last_failure = np.full(len(self.outages), -1)
+        self._n_failures = 0
+        self.screen_outages = screen and len(self.outages) > 0
+        if self.screen_outages:
+            self._init_screen(net)
+        self.islanded = islanded_buses(net, self.outages) if islanding else None
+        self.prune = prune
+        self.validate = validate
+        # (probe bus, element, index) of the checks that only failed for a pruned outage
+        self.pruning_errors = []
+        self.relevance = None
+        if prune is not None and len(self.outages):
+            self.bus_lookup = net._pd2ppc_lookups['bus'].copy()
+            self.relevance = injection_shares(net, self._outage_rows(net))
+            # outages that fail without the probe have a small share at most buses but are relevant at every bus
+            islanded = self.islanded if self.islanded is not None else islanded_buses(net, self.outages)
+            load_buses = net.load.bus.values[net.load.in_service.values.astype(bool)]
+            failing = set(tuple(outage) for outage in base_failures or [])
+            self.always_tested = np.array([outage in failing or np.isin(cut, load_buses).any()
+                                           for outage, cut in zip(self.outages, islanded)], dtype=bool)
+
+    @property
+    def contingency_scenario(self):
+        return [[i for element, i in self.outages if element == 'line'],
+                [i for element, i in self.outages if element == 'trafo']]
+
+    def order(self):
+        """
+        Positions of the outages in the order they are tested. With fail_fast the outages that failed most
+        checks of the run come first, ties by the latest failure and then by the order of contingency_scenario.
+        """
+        if not self.fail_fast or not self._n_failures:
+            return list(range(len(self.outages)))
+        return [int(j) for j in np.lexsort((np.arange(len(self.outages)), -self.last_failure, -self.failures))]
+
+    def record_failure(self, j):
+        """
+        Counts a failed check of the outage at position j
+        """
+        self.failures[j] += 1
+        self.last_failure[j] = self._n_failures
+        self._n_failures += 1
+
+    def groups(self, bus=None, classes=None):
+        """
+        Positions of the outages to test for a probe at bus, in the order of order(). One group, or with validate
+        a second group of the pruned outages that are tested after the first. Outages that the screen classes
+        of the check (see screen) mark violating, or with a screen mark for an AC check, are not pruned.
+        """
+        order = self.order()
+        if self.relevance is None or bus is None:
+            return [order]
+        relevant = (self.relevance[self.bus_lookup[bus]] >= self.prune) | self.always_tested
+        if classes is not None:
+            classes = np.asarray(classes)
+            relevant |= classes == VIOLATING
+            if self.screen_outages:
+                relevant |= classes == CHECK
+        tested = [j for j in order if relevant[j]]
+        pruned = [j for j in order if not relevant[j]]
+        self.stats['pruned'] += len(pruned)
+        return [tested, pruned] if self.validate else [tested]
+
+    def record_pruning_error(self, bus, j):
+        """
+        Records that the check of a probe at bus only failed for the pruned outage at position j
+        """
+        self.pruning_errors.append((bus,) + tuple(self.outages[j]))
+
+    def _outage_rows(self, net):
+        rows = {element: _branch_rows(net, element) for element in _BRANCH_BUSES}
+        return np.array([rows[element][net[element].index.get_loc(i)] for element, i in self.outages], dtype=int)
+
+    def _init_screen(self, net):
+        rows = {element: _branch_rows(net, element) for element in _BRANCH_BUSES}
+        lodf, transfer = distribution_factors(net, self._outage_rows(net))
+        self.lodf = {element: lodf[rows[element]] for element in _BRANCH_BUSES}
+        self.ratings = _ratings(net)
+        # the outaged branch in every outage column, to take its own flow from the intact results
+        self.outage_element = np.array([element for element, _ in self.outages])
+        self.outage_pos = np.array([net[element].index.get_loc(i) for element, i in self.outages], dtype=int)
+        # voltage change per MW of pre-outage flow, from the compensation injection at the terminal buses
+        dvm = sensitivity.injection_sensitivities(net)['vm_pu']
+        terminals = [net[element].loc[i, list(_BRANCH_BUSES[element])].values for element, i in self.outages]
+        from_bus = [terminal[0] for terminal in terminals]
+        to_bus = [terminal[1] for terminal in terminals]
+        self.dvm = (dvm[from_bus].values - dvm[to_bus].values) * transfer[None, :]
+        self.islanding = np.isnan(transfer)
+
+    def _outage_flows(self, net):
+        p = {element: net['res_' + element][_BRANCH_FLOWS[element][0]].values for element in _BRANCH_BUSES}
+        outage_p = np.empty(len(self.outages))
+        for element in _BRANCH_BUSES:
+            mask = self.outage_element == element
+            outage_p[mask] = p[element][self.outage_pos[mask]]
+        return p, outage_p
+
+    def screen(self, net, vmax=1.1, vmin=0.9, max_line_loading=100., max_trafo_loading=100., p_lim=1000.,
+               run_control=False):
+        """
+        Classifies the outages from the results of the intact case in net.
+        Outages that island a load bus, including a load probe at its current bus, are violating.
+
+        INPUT
+            net (PP net) - Pandapower net with the results of the intact case, same topology as when the engine was built
+            vmax, vmin, max_line_loading, max_trafo_loading, p_lim - Limits of the contingencies, see check_violations
+            run_control (bool) - Controllers act after the outage, estimated voltage violations are then checked
+                                 with AC power flows since the controllers can bring the voltages back
+
+        OUTPUT
+            classes (list) - SAFE, VIOLATING or CHECK per outage, in the order of outages
+            checks (list) - Estimated violations per outage as in check_violations
+            margins (array) - Estimated smallest relative margin per outage, see analysis_check.violation_margins,
+                              NaN for outages without an estimate
+        """
+        n = len(self.outages)
+        if not self.screen_outages:
+            classes, checks, margins = [CHECK] * n, [None] * n, np.full(n, np.nan)
+        else:
+            classes, checks, margins = self._screen(net, vmax, vmin, max_line_loading, max_trafo_loading, p_lim, run_control)
+        if self.islanded is not None:
+            # out of service loads, e.g. a parked probe, are not supplied by the outage
+            load_buses = net.load.bus.values[net.load.in_service.values.astype(bool)]
+            for j in range(n):
+                if len(self.islanded[j]) and np.isin(self.islanded[j], load_buses).any():
+                    classes[j] = VIOLATING
+                    checks[j] = (False, False, False, False, False, True, False)
+                    margins[j] = np.nan
+                    self.stats['islanding'] += 1
+        return classes, checks, margins
+
+    def _screen(self, net, vmax, vmin, max_line_loading, max_trafo_loading, p_lim, run_control):
+        n = len(self.outages)
+        bands = self.bands
+        p, outage_p = self._outage_flows(net)
+
+        estimates = {}
+        for element in _BRANCH_BUSES:
+            flows = net['res_' + element]
+            q = flows[_BRANCH_FLOWS[element][1]].values[:, None]
+            p_pre = p[element][:, None]
+            p_post = p_pre + self.lodf[element] * outage_p[None, :]
+            with np.errstate(invalid='ignore'):
+                estimates[element] = (flows.loading_percent.values[:, None] + 100. * (np.hypot(p_post, q) - np.hypot(p_pre, q))
+                                      / np.where(self.ratings[element] > 0, self.ratings[element], np.inf)[:, None])
+            # the outaged branch carries nothing
+            mask = self.outage_element == element
+            estimates[element][self.outage_pos[mask], np.flatnonzero(mask)] = 0.
+        vm = net.res_bus.vm_pu.values[:, None] + self.dvm * outage_p[None, :]
+
+        limits = [(vm, vmax, 1, bands['vm']), (vm, vmin, -1, bands['vm']),
+                  (estimates['line'], max_line_loading, 1, bands['loading']),
+                  (estimates['trafo'], max_trafo_loading, 1, bands['loading'])]
+        over, near, margins = [], [], []
+        for values, limit, sign, band in limits:
+            # elements without results, e.g. out of service, are not screened
+            distance = sign * (limit - values)
+            with np.errstate(invalid='ignore'):
+                over.append(np.any(distance < -band, axis=0))
+                near.append(np.any(distance <= band, axis=0))
+            margins.append(np.nanmin(np.where(np.isnan(distance), np.inf, distance), axis=0, initial=np.inf) / abs(limit))
+        p_ext = net.res_ext_grid.p_mw.max() if len(net.res_ext_grid) else 0.
+        ext_near = not p_ext < p_lim * (1. - bands['p'])
+        if run_control:
+            # voltages are not screened as violating, the controllers can correct them
+            over[0] = over[1] = np.zeros(n, dtype=bool)
+        unknown = self.islanding | np.isnan(outage_p)
+
+        classes, checks = [], []
+        for j in range(n):
+            check = (over[0][j], over[1][j], over[2][j], over[3][j], False, False, False)
+            if unknown[j]:
+                classes.append(CHECK)
+            elif any(check):
+                classes.append(VIOLATING)
+            elif not ext_near and not any(near_k[j] for near_k in near):
+                classes.append(SAFE)
+            else:
+                classes.append(CHECK)
+            checks.append(check)
+            self.stats[classes[-1]] += 1
+        return classes, checks, np.min(margins, axis=0)
@@ -0,0 +1,188 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+"""
+Persistent cache for headroom results, keyed by the state of the net and the parameters of the study.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import pandas as pd
+
+# Tables that define the power flow of a net
+_NET_TABLES = ['bus', 'line', 'trafo', 'trafo3w', 'load', 'sgen', 'gen', 'ext_grid', 'shunt', 'switch',
+               'impedance', 'ward', 'xward', 'storage', 'dcline', 'motor']
+# Name of the capacity probe, see capacity_analysis.add_loadgen and create_probe
+_PROBE_NAME = 'Cap test'
+
+
+def _hash_table(h, table):
+    h.update(repr(list(table.columns)).encode())
+    h.update(repr(list(table.dtypes.astype(str))).encode())
+    try:
+        h.update(pd.util.hash_pandas_object(table, index=True).values.tobytes())
+    except TypeError:
+        # unhashable cells, e.g. lists
+        h.update(table.to_csv().encode())
+
+
+def _controller_state(ctrl):
+    """
+    Parameters of a controller object that are plain values
+    """
+    plain = (int, float, str, bool, type(None), list, tuple)
+    return type(ctrl).__name__, sorted((k, repr(v)) for k, v in vars(ctrl).items() if isinstance(v, plain))
+
+
+def net_key(net):
+    """
+    Stable hash of the element tables and controllers of a net. Capacity probes are left out.
+
+    INPUT
+        net (PP net) - Pandapower net
+
+    OUTPUT
+        key (str) - Hex digest
+    """
+    h = hashlib.sha256()
+    for element in _NET_TABLES:
+        if element not in net:
+            continue
+        table = net[element]
+        if 'name' in table and element in ('load', 'sgen'):
+            table = table[table.name != _PROBE_NAME]
+        h.update(element.encode())
+        _hash_table(h, table)
+    if 'controller' in net and len(net.controller):
+        _hash_table(h, net.controller.drop(columns='object'))
+        for ctrl in net.controller.object:
+            h.update(repr(_controller_state(ctrl)).encode())
+    return h.hexdigest()
+
+
+def study_key(net_hash, **params):
+    """
+    Key of a study on a net with net_key net_hash, params are the parameters that define the result,
+    e.g. loadorgen, limits and contingency_scenario
+    """
+    h = hashlib.sha256(net_hash.encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class HeadroomCache:
+    """
+    Headroom results on local disk, the least recently used entries are evicted when the cache
+    grows above max_size_mb. Whole headroom frames and single bus results are stored, single bus
+    results are keyed without upper_lim_p so that they can be reused by a study with another upper_lim_p
+    where valid, see get_bus.
+
+    INPUT
+        directory (str) - Folder of the cache, created if missing
+        max_size_mb (float, 500) - Max size of the cache on disk
+    """
+
+    def __init__(self, directory, max_size_mb=500.):
+        self.directory = directory
+        self.max_size_mb = max_size_mb
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """
+        Returns the stored value of key, None if it is not in the cache
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def put(self, key, value):
+        """
+        Stores value under key, the file is replaced atomically so several processes can share the cache
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(tmp, self._path(key))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is below max_size_mb
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(e[1] for e in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size_mb * 1e6:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def get_headroom(self, key):
+        """
+        Returns a stored headroom frame, None if missing
+        """
+        headroom = self.get(key)
+        return None if headroom is None else headroom.copy()
+
+    def put_headroom(self, key, headroom):
+        self.put(key, headroom)
+        self.evict()
+
+    def get_bus(self, key, bus, upper_lim_p):
+        """
+        Returns the stored headroom of a bus valid for upper_lim_p, None if missing.
+        A headroom below the upper limit it was searched with is valid for any upper_lim_p above it,
+        a bus where the full upper limit was available only for the same upper_lim_p, since a search with a lower
+        upper_lim_p can end at another point within s_tol.
+        """
+        entry = self.get(study_key(key, bus=str(bus)))
+        if entry is None:
+            return None
+        head, searched_upper = entry[:2]
+        if head < searched_upper and head < upper_lim_p:
+            return head
+        if upper_lim_p == searched_upper:
+            return head
+        return None
+
+    def get_bus_binding(self, key, bus):
+        """
+        Returns the binding constraint stored with the headroom of a bus, see put_bus, None if missing
+        """
+        entry = self.get(study_key(key, bus=str(bus)))
+        if entry is None or len(entry) < 3:
+            return None
+        return entry[2]
+
+    def put_bus(self, key, bus, head, upper_lim_p, binding=None):
+        """
+        Stores the headroom of a bus searched up to upper_lim_p, binding is the constraint above the headroom,
+        e.g. (text, violated elements) of capacity_analysis.feas_chk
+        """
+        self.put(study_key(key, bus=str(bus)), (head, upper_lim_p, binding))
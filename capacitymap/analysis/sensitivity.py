@@ -0,0 +1,142 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+"""
+Linear sensitivities of a converged net to active power injections, used to predict the headroom
+at every bus before it is verified with AC power flows.
+"""
+
+import numpy as np
+import pandas as pd
+import pandapower as pp
+from scipy.sparse import hstack, vstack
+from scipy.sparse.linalg import splu
+from pandapower.pypower.makeYbus import makeYbus
+from pandapower.pypower.dSbus_dV import dSbus_dV
+from pandapower.pypower.idx_bus import BUS_TYPE, VM, VA, PQ, PV
+
+
+def _branch_loading_sensitivity(Yf, Yt, V, dV, loading, branch_range):
+    """
+    Change of loading_percent of the branches in branch_range per column of dV,
+    linearised on the side carrying the larger current
+    """
+    start, end = branch_range
+    i_f = Yf[start:end] @ V
+    i_t = Yt[start:end] @ V
+    use_from = np.abs(i_f) >= np.abs(i_t)
+    i_b = np.where(use_from, i_f, i_t)
+    di_b = np.where(use_from[:, None], Yf[start:end] @ dV, Yt[start:end] @ dV)
+    abs_i = np.abs(i_b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel = np.real(np.conj(i_b)[:, None] * di_b) / (abs_i ** 2)[:, None]
+    rel[abs_i == 0] = 0.
+    return np.nan_to_num(loading)[:, None] * rel
+
+
+def injection_sensitivities(net):
+    """
+    Sensitivities of bus voltages, line loadings and trafo loadings to 1 MW injected at every bus.
+    Uses the Jacobian of the last power flow of the net, one factorization for all buses.
+
+    INPUT
+        net (PP net) - Pandapower net with results of a converged Newton-Raphson power flow
+
+    OUTPUT
+        sens (dict) - DataFrames with the injection bus as columns:
+                      'vm_pu' (pu/MW) indexed as net.bus,
+                      'line_loading' (%/MW) indexed as net.line,
+                      'trafo_loading' (%/MW) indexed as net.trafo
+    """
+    ppc = net._ppc
+    bus, branch, baseMVA = ppc['bus'], ppc['branch'], ppc['baseMVA']
+    Ybus, Yf, Yt = makeYbus(baseMVA, bus, branch)
+    Yf, Yt = Yf.tocsr(), Yt.tocsr()
+    V = bus[:, VM] * np.exp(1j * np.deg2rad(bus[:, VA]))
+
+    pv = np.flatnonzero(bus[:, BUS_TYPE] == PV)
+    pq = np.flatnonzero(bus[:, BUS_TYPE] == PQ)
+    pvpq = np.r_[pv, pq]
+    dS_dVm, dS_dVa = dSbus_dV(Ybus, V)
+    J = vstack([hstack([dS_dVa[pvpq][:, pvpq].real, dS_dVm[pvpq][:, pq].real]),
+                hstack([dS_dVa[pq][:, pvpq].imag, dS_dVm[pq][:, pq].imag])], format='csc')
+    lu = splu(J)
+
+    # unit injection in every pv/pq bus of the net, the slack takes the balance
+    bus_lookup = net._pd2ppc_lookups['bus']
+    ppc_bus = bus_lookup[net.bus.index.values]
+    pvpq_pos = np.full(len(bus), -1)
+    pvpq_pos[pvpq] = np.arange(len(pvpq))
+    inj_pos = pvpq_pos[ppc_bus]
+    injecting = np.flatnonzero(inj_pos >= 0)
+    rhs = np.zeros((J.shape[0], len(injecting)))
+    rhs[inj_pos[injecting], np.arange(len(injecting))] = 1. / baseMVA
+    x = lu.solve(rhs)
+
+    dVa = np.zeros((len(bus), len(net.bus)))
+    dVm = np.zeros((len(bus), len(net.bus)))
+    dVa[np.ix_(pvpq, injecting)] = x[:len(pvpq)]
+    dVm[np.ix_(pq, injecting)] = x[len(pvpq):]
+    dV = V[:, None] * (dVm / np.where(bus[:, VM] > 0, bus[:, VM], 1.)[:, None] + 1j * dVa)
+
+    dvm_bus = dVm[ppc_bus]
+    oos_bus = ~net.bus.in_service.values
+    dvm_bus[oos_bus] = 0.
+    dvm_bus[:, oos_bus] = 0.
+    sens = {'vm_pu': pd.DataFrame(dvm_bus, index=net.bus.index, columns=net.bus.index)}
+    for element in ['line', 'trafo']:
+        if len(net[element]) and element in net._pd2ppc_lookups['branch']:
+            s = _branch_loading_sensitivity(Yf, Yt, V, dV, net['res_' + element].loading_percent.values,
+                                            net._pd2ppc_lookups['branch'][element])
+        else:
+            s = np.zeros((len(net[element]), len(net.bus)))
+        sens[element + '_loading'] = pd.DataFrame(s, index=net[element].index, columns=net.bus.index)
+    return sens
+
+
+def predict_headroom(net, loadorgen, upper_lim_p, normal_limits=None, sens=None):
+    """
+    Predicts the headroom at every bus from the linear sensitivities of the base case.
+    Controllers, contingencies and non-linearities are not included, the prediction
+    is meant as a starting point for the AC search in capacity_analysis.max_cap.
+
+    INPUT
+        net (PP net) - Pandapower net, the base case power flow is run if sens is None
+        loadorgen (str) - 'sgen' or 'load' for generation or load for additional capacity connected
+        upper_lim_p (float) - Max capacity (MW), predictions are limited to [0, upper_lim_p]
+        normal_limits (dict) - Limits for normal operation, default limits of check_violations if None
+        sens (dict) - Sensitivities from injection_sensitivities of the base case results in net, e.g. to
+                      predict load and sgen headroom from one factorization
+
+    OUTPUT
+        prediction (Series) - Predicted headroom (MW) per bus, NaN where no prediction could be made
+    """
+    if normal_limits is None:
+        normal_limits = {'vmax': 1.1, 'vmin': 0.9, 'max_line_loading': 100., 'max_trafo_loading': 100.,
+                         'subscription_p_limits': 1000.}
+    if sens is None:
+        pp.runpp(net)
+        sens = injection_sensitivities(net)
+    # load is a negative injection
+    direction = -1. if loadorgen == 'load' else 1.
+
+    vm = net.res_bus.vm_pu.values
+    dvm = direction * sens['vm_pu'].values
+    margins = [normal_limits['vmax'] - vm, vm - normal_limits['vmin'],
+               normal_limits['max_line_loading'] - net.res_line.loading_percent.values,
+               normal_limits['max_trafo_loading'] - net.res_trafo.loading_percent.values]
+    rates = [dvm, -dvm, direction * sens['line_loading'].values, direction * sens['trafo_loading'].values]
+    if loadorgen == 'load':
+        # added load is imported through the ext_grid, losses neglected
+        margins.append(np.atleast_1d(normal_limits['subscription_p_limits'] - net.res_ext_grid.p_mw.max()))
+        rates.append(np.ones((1, len(net.bus))))
+
+    margin = np.concatenate(margins)
+    rate = np.vstack(rates)
+    keep = ~np.isnan(margin)
+    margin, rate = margin[keep], rate[keep]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(rate > 1e-9, np.maximum(margin, 0.)[:, None] / rate, np.inf)
+    prediction = np.clip(ratio.min(axis=0, initial=np.inf), 0., upper_lim_p)
+    prediction[~net.bus.in_service.values] = np.nan
+    return pd.Series(prediction, index=net.bus.index)
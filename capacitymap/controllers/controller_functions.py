@@ -1,6 +1,167 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright Contributors to Grid Capacity Map
 
+from collections import defaultdict
+import numpy as np
+from capacitymap.controllers.discrete_trafo_controller import DiscreteTapControl
+from capacitymap.controllers.discrete_shunt_controller import DiscreteShuntControl
+from capacitymap.controllers.discrete_trafo_group_controller import DiscreteTapControlGroup
+from capacitymap.controllers import oscillation
+
+
+def _init_state(ctrl):
+    """
+    Initial position and controlled elements of a discrete controller as plain values, None for other controllers
+    """
+    init = getattr(ctrl, 'init_pos', getattr(ctrl, 'init_step', None))
+    if init is None:
+        return None
+    element = getattr(ctrl, 'tid', getattr(ctrl, 'sid', None))
+    return np.atleast_1d(init).tolist(), np.atleast_1d(element).tolist()
+
+
+class ControllerSnapshot:
+    """
+    State owned by the controllers of a net, kept as arrays and written back with one write per table:
+    tap_pos of the trafos of DiscreteTapControl and DiscreteTapControlGroup, q_mvar of the shunts of DiscreteShuntControl
+    with the step of the controllers. The oscillation state of the controllers starts over on restore.
+    Other controllers are restored with their own restore_init_state.
+
+    INPUT
+        net (PP net) - Pandapower net with controllers
+        initial (bool) - Capture the initial state of the controllers (init_pos, init_step) instead of the current one
+    """
+
+    def __init__(self, net, initial=False):
+        self.table = net.controller
+        self.objects = list(net.controller.object.values)
+        # initial positions the snapshot was taken from, None for a snapshot of the current state
+        self.init = [_init_state(ctrl) for ctrl in self.objects] if initial else None
+        taps = defaultdict(list)
+        shunts = []
+        self.groups = []
+        self.others = []
+        for ctrl in net.controller.object.values:
+            if isinstance(ctrl, DiscreteTapControl):
+                taps[ctrl.trafotable].append(ctrl)
+            elif isinstance(ctrl, DiscreteShuntControl):
+                shunts.append(ctrl)
+            elif isinstance(ctrl, DiscreteTapControlGroup):
+                tap_pos = ctrl.init_pos if initial else net[ctrl.trafotable].loc[ctrl.tid, 'tap_pos'].values
+                self.groups.append((ctrl, np.array(tap_pos, dtype=float)))
+            elif initial:
+                self.others.append(ctrl)
+
+        # trafo table -> (controllers, trafo indices, tap positions)
+        self.taps = {}
+        for table, ctrls in taps.items():
+            tids = np.array([ctrl.tid for ctrl in ctrls])
+            if initial:
+                tap_pos = np.array([ctrl.init_pos for ctrl in ctrls], dtype=float)
+            else:
+                tap_pos = net[table].loc[tids, 'tap_pos'].values.astype(float)
+            self.taps[table] = (ctrls, tids, tap_pos)
+
+        self.shunts = shunts
+        self.sids = np.array([ctrl.sid for ctrl in shunts])
+        if initial:
+            self.shunt_steps = [ctrl.init_step for ctrl in shunts]
+            self.shunt_q = np.array([ctrl.steps[ctrl.init_step] for ctrl in shunts], dtype=float)
+        else:
+            self.shunt_steps = [ctrl.tap_pos for ctrl in shunts]
+            self.shunt_q = net.shunt.loc[self.sids, 'q_mvar'].values.astype(float) if len(shunts) else np.zeros(0)
+
+    def valid(self, net):
+        """
+        True if the snapshot was taken of the controller objects of net, e.g. not after controllers were replaced
+        with DiscreteTapControlGroup.from_controllers, and for an initial snapshot if their initial positions are unchanged
+        """
+        objects = net.controller.object.values
+        if net.controller is not self.table or len(objects) != len(self.objects):
+            return False
+        if any(ctrl is not old for ctrl, old in zip(objects, self.objects)):
+            return False
+        return self.init is None or [_init_state(ctrl) for ctrl in objects] == self.init
+
+    def restore(self, net):
+        """
+        Writes the captured state to net and to the controllers
+        """
+        for table, (ctrls, tids, tap_pos) in self.taps.items():
+            net[table].loc[tids, 'tap_pos'] = tap_pos
+            for ctrl, pos in zip(ctrls, tap_pos):
+                ctrl.tap_pos = pos
+                oscillation.reset(ctrl)
+        for ctrl, tap_pos in self.groups:
+            net[ctrl.trafotable].loc[ctrl.tid, 'tap_pos'] = tap_pos
+            ctrl.tap_pos = tap_pos.copy()
+            oscillation.reset(ctrl)
+        if len(self.shunts):
+            net.shunt.loc[self.sids, 'q_mvar'] = self.shunt_q
+            for ctrl, step in zip(self.shunts, self.shunt_steps):
+                ctrl.tap_pos = step
+                oscillation.reset(ctrl)
+        for ctrl in self.others:
+            ctrl.restore_init_state(net)
+
+
+# Initial state of the controllers of the net last reset by reset_all_controllers
+_initial_snapshot = None
+
+
+def initial_snapshot(net):
+    """
+    Returns the ControllerSnapshot of the initial state of the controllers of net, captured on the first call
+    and reused while it is valid for net, see ControllerSnapshot.valid
+    """
+    global _initial_snapshot
+    if _initial_snapshot is None or not _initial_snapshot.valid(net):
+        _initial_snapshot = ControllerSnapshot(net, initial=True)
+    return _initial_snapshot
+
+
 def reset_all_controllers(net):
-    for idx, ctr in net.controller.iterrows():
-        ctr.object.restore_init_state(net)
\ No newline at end of file
+    """
+    Restores all controllers of net to their initial state, see ControllerSnapshot
+    """
+    initial_snapshot(net).restore(net)
+
+
+def set_multi_step(net, multi_step=True):
+    """
+    Switches the discrete tap and shunt controllers of net to stepping several positions per control step,
+    estimated from the tap step and the observed dV/dQ, or back to one position with multi_step=False
+    """
+    for ctrl in net.controller.object.values:
+        if isinstance(ctrl, (DiscreteTapControl, DiscreteShuntControl, DiscreteTapControlGroup)):
+            ctrl.multi_step = multi_step
+
+
+class ControllerWarmStart:
+    """
+    Converged controller positions per topology, e.g. of the intact net and of every outage of a contingency scenario,
+    so that the checks of a capacity search start the controllers where the previous check of the same topology
+    converged. A topology without converged positions starts from the initial state of the controllers.
+    """
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def restore(self, net, topology=None):
+        """
+        Restores the controllers to the positions stored for topology, e.g. None for the intact net or
+        (element, index) of an outage, or to their initial state if none are stored
+        """
+        snapshot = self.snapshots.get(topology)
+        if snapshot is None or not snapshot.valid(net):
+            reset_all_controllers(net)
+            return
+        snapshot.restore(net)
+        for ctrl in initial_snapshot(net).others:
+            ctrl.restore_init_state(net)
+
+    def store(self, net, topology=None):
+        """
+        Stores the current controller positions for topology, call after a converged check
+        """
+        self.snapshots[topology] = ControllerSnapshot(net)
@@ -30,6 +30,7 @@ WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 
 
 from capacitymap.controllers.shunt_controller import ShuntController
+from capacitymap.controllers import oscillation
 
 class DiscreteShuntControl(ShuntController):
     """
@@ -44,13 +45,15 @@ class DiscreteShuntControl(ShuntController):
         **init_step** (int) - Initial step, must be a valid index in steps 
     OPTIONAL:
         **tol** (float, 0.001) - Voltage tolerance band at bus in Percent (default: 1% = 0.01pu)
+        **multi_step** (bool, False) - Jump to the first step that is estimated to bring the voltage into the band,
+            using the dV/dQ at the bus observed from the previous step, instead of moving one step
         **in_service** (bool, True) - Indicates if the controller is currently in_service
         **drop_same_existing_ctrl** (bool, False) - Indicates if already existing controllers of the same type and with the same matching parameters (e.g. at same element) should be dropped
     """
 
     def __init__(self, net, sid,bid, vm_lower_pu, vm_upper_pu, steps, init_step,
                  tol=1e-3, in_service=True, order=0, drop_same_existing_ctrl=False,
-                  **kwargs):
+                 multi_step=False, **kwargs):
         
         super(DiscreteShuntControl, self).__init__(net, sid, bid, tol, in_service, steps, init_step, order,**kwargs)
 
@@ -59,23 +62,59 @@ class DiscreteShuntControl(ShuntController):
         self.steps = steps
         self.tap_pos = init_step
         self.init_step = init_step
-        self.tested_steps = [] 
-   
+        oscillation.reset(self)
+        self.multi_step = multi_step
+        self.dvdq = None  # dV/dQ at the controlled bus in pu/Mvar, observed from the steps taken
+        self.last_step = None  # (vm_pu, q_mvar) before the last step of this control loop
+
+    def initialize_control(self, net):
+        self.last_step = None
+        oscillation.reset(self)
+        oscillation.damping.reset()
+
+    def multi_step_pos(self, vm_pu, q_mvar, direction):
+        """
+        First step in direction that is estimated by dV/dQ to bring vm_pu over the violated limit, or the last step
+        """
+        tap_pos = self.tap_pos + direction
+        while self.tap_min <= tap_pos + direction <= self.tap_max:
+            vm_est = vm_pu + self.dvdq * (self.steps[tap_pos] - q_mvar)
+            if (direction == 1 and vm_est > self.vm_lower_pu) or (direction == -1 and vm_est < self.vm_upper_pu):
+                break
+            tap_pos += direction
+        return tap_pos
+
     def control_step(self, net):
         """
-        Implements one step of the Discrete controller, always stepping only one tap position up or down
+        Implements one step of the Discrete controller, stepping only one tap position up or down,
+        or with multi_step as many as estimated by multi_step_pos
         """
         vm_pu = net.res_bus.at[self.controlled_bus, "vm_pu"]
-        
+        q_mvar = net['shunt'].at[self.sid, "q_mvar"]
+        # controllers loaded with pp.from_json from nets saved before multi_step have none of its attributes
+        multi_step = getattr(self, 'multi_step', False)
+        last_step = getattr(self, 'last_step', None)
+        if multi_step and last_step is not None and q_mvar != last_step[1]:
+            dvdq = (vm_pu - last_step[0]) / (q_mvar - last_step[1])
+            # consuming more reactive power lowers the voltage, other estimates are disturbed by other controllers
+            if dvdq < 0:
+                self.dvdq = dvdq
+        self.last_step = (vm_pu, q_mvar)
 
         #Check in which direction to controll the shunt. 
         if vm_pu < self.vm_lower_pu: #if voltage is lower then lower lim, move to the right(increase injected reactive power)
-            self.tap_pos += 1 
+            direction = 1
         elif vm_pu > self.vm_upper_pu: #if voltage is above upper lim, move to the left (decrease injected reactive power)
-            self.tap_pos -= 1 
+            direction = -1
+        else:
+            direction = 0
+
+        if multi_step and getattr(self, 'dvdq', None) is not None and direction != 0:
+            self.tap_pos = self.multi_step_pos(vm_pu, q_mvar, direction)
+        else:
+            self.tap_pos += direction
         
-        
-        self.tested_steps.append(self.tap_pos) #add tap_pos to tested steps
+        oscillation.step(self, direction)
         # WRITE TO NET
         net['shunt'].at[self.sid, "q_mvar"] = self.steps[self.tap_pos]
 
@@ -110,9 +149,10 @@ class DiscreteShuntControl(ShuntController):
             return True
         elif vm_pu > self.vm_upper_pu and self.tap_pos == self.tap_min:
             return True
-        elif len(self.tested_steps) != len(set(self.tested_steps)): #if size of step results in going from to low voltage directly to to high or vice versa
-            # WRITE TO NET
-            net['shunt'].at[self.sid, "q_mvar"] = self.steps[self.tested_steps[-1]] #set q_mvar to the last tested signal and then accept that the criteria is not met.
+        elif oscillation.frozen(self):
+            return True
+        elif oscillation.oscillating(self) and oscillation.damping.damp(net, self): #if size of step results in going from to low voltage directly to to high or vice versa
+            # keep the last tested step and accept that the criteria is not met.
             return True
         
         return self.vm_lower_pu < vm_pu < self.vm_upper_pu 
@@ -120,6 +160,7 @@ class DiscreteShuntControl(ShuntController):
     def restore_init_state(self, net):
         self.tap_pos = self.init_step
         net['shunt'].at[self.sid, "q_mvar"] = self.steps[self.tap_pos]
-        self.tested_steps = [] 
+        oscillation.reset(self)
+        self.last_step = None 
 
         
\ No newline at end of file
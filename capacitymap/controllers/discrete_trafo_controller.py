@@ -28,7 +28,9 @@ WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 """
 
 
+import numpy as np
 from pandapower.control.controller.trafo_control import TrafoController
+from capacitymap.controllers import oscillation
 
 class DiscreteTapControl(TrafoController):
     """
@@ -42,13 +44,14 @@ class DiscreteTapControl(TrafoController):
         **side** (string, "lv") - Side of the transformer where the voltage is controlled (hv or lv)
         **trafotype** (float, "2W") - Trafo type ("2W" or "3W")
         **tol** (float, 0.001) - Voltage tolerance band at bus in Percent (default: 1% = 0.01pu)
+        **multi_step** (bool, False) - Step as many tap positions as estimated from tap_step_percent to reach the band, instead of one
         **in_service** (bool, True) - Indicates if the controller is currently in_service
         **drop_same_existing_ctrl** (bool, False) - Indicates if already existing controllers of the same type and with the same matching parameters (e.g. at same element) should be dropped
     """
 
     def __init__(self, net, tid, vm_lower_pu, vm_upper_pu, side="lv", trafotype="2W",
                  tol=1e-3, in_service=True, order=0, drop_same_existing_ctrl=False,
-                 matching_params=None, **kwargs):
+                 matching_params=None, multi_step=False, **kwargs):
         if matching_params is None:
             matching_params = {"tid": tid, 'trafotype': trafotype}
         super(DiscreteTapControl, self).__init__(
@@ -64,6 +67,8 @@ class DiscreteTapControl(TrafoController):
         self.vm_set_pu = kwargs.get("vm_set_pu")
 
         self.init_pos = self.tap_pos
+        self.multi_step = multi_step
+        oscillation.reset(self)
         
 
     @classmethod
@@ -99,24 +104,44 @@ class DiscreteTapControl(TrafoController):
     def initialize_control(self, net):
         if hasattr(self, 'vm_set_pu') and self.vm_set_pu is not None:
             self.vm_delta_pu = net[self.trafotable].at[self.tid, "tap_step_percent"] / 100. * .5 + self.tol
+        oscillation.reset(self)
+        oscillation.damping.reset()
+
+    def tap_steps(self, net, vm_pu):
+        """
+        Number of tap positions to step. One, or with multi_step the fewest positions that bring vm_pu into the band
+        when each position changes the voltage by tap_step_percent
+        """
+        # controllers loaded with pp.from_json from nets saved before multi_step have no multi_step
+        if not getattr(self, 'multi_step', False):
+            return 1
+        vm_step_pu = abs(net[self.trafotable].at[self.tid, "tap_step_percent"]) / 100. * vm_pu
+        deviation = max(self.vm_lower_pu - vm_pu, vm_pu - self.vm_upper_pu)
+        if not vm_step_pu > 0 or not deviation > 0:
+            return 1
+        return max(1, int(np.ceil(deviation / vm_step_pu)))
 
     def control_step(self, net):
         """
-        Implements one step of the Discrete controller, always stepping only one tap position up or down
+        Implements one step of the Discrete controller, stepping one tap position up or down, or with multi_step
+        as many positions as estimated by tap_steps within the tap limits
         """
         vm_pu = net.res_bus.at[self.controlled_bus, "vm_pu"]
         self.tap_pos = net[self.trafotable].at[self.tid, "tap_pos"]
+        previous_pos = self.tap_pos
+        n = self.tap_steps(net, vm_pu)
 
         if self.tap_side_coeff * self.tap_sign == 1:
             if vm_pu < self.vm_lower_pu and self.tap_pos > self.tap_min:
-                self.tap_pos -= 1
+                self.tap_pos = max(self.tap_pos - n, self.tap_min)
             elif vm_pu > self.vm_upper_pu and self.tap_pos < self.tap_max:
-                self.tap_pos += 1
+                self.tap_pos = min(self.tap_pos + n, self.tap_max)
         elif self.tap_side_coeff * self.tap_sign == -1:
             if vm_pu < self.vm_lower_pu and self.tap_pos < self.tap_max:
-                self.tap_pos += 1
+                self.tap_pos = min(self.tap_pos + n, self.tap_max)
             elif vm_pu > self.vm_upper_pu and self.tap_pos > self.tap_min:
-                self.tap_pos -= 1
+                self.tap_pos = max(self.tap_pos - n, self.tap_min)
+        oscillation.step(self, self.tap_pos - previous_pos)
 
         # WRITE TO NET
         net[self.trafotable].at[self.tid, "tap_pos"] = self.tap_pos
@@ -144,8 +169,16 @@ class DiscreteTapControl(TrafoController):
                 return True
             elif vm_pu > self.vm_upper_pu and self.tap_pos == self.tap_min:
                 return True
-        return self.vm_lower_pu < vm_pu < self.vm_upper_pu
+        if self.vm_lower_pu < vm_pu < self.vm_upper_pu:
+            return True
+        # with damping.taps, tap changers that keep stepping back and forth are damped, see oscillation.damping
+        if not oscillation.damping.taps:
+            return False
+        if oscillation.frozen(self):
+            return True
+        return bool(oscillation.oscillating(self) and oscillation.damping.damp(net, self))
 
     def restore_init_state(self, net):
         self.tap_pos = self.init_pos
+        oscillation.reset(self)
         net[self.trafotable].at[self.tid, "tap_pos"] = self.tap_pos
\ No newline at end of file
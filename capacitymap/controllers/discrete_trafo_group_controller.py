@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+import numpy as np
+from pandapower.control.basic_controller import Controller
+from capacitymap.controllers.discrete_trafo_controller import DiscreteTapControl
+from capacitymap.controllers import oscillation
+
+try:
+    import pplog as logging
+except ImportError:
+    import logging
+logger = logging.getLogger(__name__)
+
+
+class DiscreteTapControlGroup(Controller):
+    """
+    Group of trafo controllers with local tap changer voltage control, stepping all trafos of one trafo table as
+    arrays. Each trafo behaves as a DiscreteTapControl: one tap position up or down per control step while the
+    voltage at its controlled bus is outside its band, converged when inside the band or at the tap limit.
+    With oscillation.damping.taps, trafos that oscillate are frozen at their current position for the rest of the
+    control loop.
+    INPUT:
+        **net** (attrdict) - Pandapower struct
+        **tid** (array of int) - IDs of the trafos that are controlled
+        **vm_lower_pu** (float or array of float) - Lower voltage limit in pu
+        **vm_upper_pu** (float or array of float) - Upper voltage limit in pu
+    OPTIONAL:
+        **side** (string or array of string, "lv") - Side of the transformers where the voltage is controlled (hv, mv or lv)
+        **trafotype** (string, "2W") - Trafo type ("2W" or "3W")
+        **tol** (float, 0.001) - Voltage tolerance band at bus in Percent, used with vm_set_pu
+        **vm_set_pu** (float or array of float, None) - Voltage setpoint in pu, replaces vm_lower_pu and vm_upper_pu by
+            the setpoint -/+ half a tap step plus tol
+        **multi_step** (bool, False) - Step as many tap positions as estimated from tap_step_percent to reach the band, instead of one
+        **in_service** (bool, True) - Indicates if the controller is currently in_service
+    """
+
+    def __init__(self, net, tid, vm_lower_pu, vm_upper_pu, side="lv", trafotype="2W", tol=1e-3, vm_set_pu=None,
+                 multi_step=False, in_service=True, level=0, order=0, recycle=True, **kwargs):
+        super().__init__(net, in_service=in_service, level=level, order=order, recycle=recycle, **kwargs)
+        if trafotype == "2W":
+            self.trafotable = "trafo"
+            tap_sides = ("hv", "lv")
+        elif trafotype == "3W":
+            self.trafotable = "trafo3w"
+            tap_sides = ("hv", "mv", "lv")
+        else:
+            raise UserWarning("Trafo type %s is not supported, use '2W' or '3W'" % trafotype)
+        self.trafotype = trafotype
+        self.tid = np.asarray(tid)
+        n = len(self.tid)
+        table = net[self.trafotable].loc[self.tid]
+
+        side = np.broadcast_to(np.asarray(side), (n,))
+        self.controlled_bus = np.zeros(n, dtype=np.int64)
+        for s in np.unique(side):
+            if s not in tap_sides:
+                raise UserWarning("Side %s is not valid for %s trafos" % (s, trafotype))
+            mask = side == s
+            self.controlled_bus[mask] = table[s + "_bus"].values[mask]
+
+        self.tap_min = table.tap_min.values.astype(float)
+        self.tap_max = table.tap_max.values.astype(float)
+        tap_side = table.tap_side.values
+        if not np.isin(tap_side, tap_sides).all():
+            raise ValueError("Trafo tap side (in net.%s) has to be one of %s" % (self.trafotable, tap_sides))
+        tap_side_coeff = np.where(tap_side == "hv", 1, -1)
+        tap_sign = np.sign(table.tap_step_percent.values.astype(float))
+        tap_sign[np.isnan(tap_sign) | (tap_sign == 0)] = 1
+        self.tap_direction = tap_side_coeff * tap_sign
+
+        self.tap_step_pu = np.abs(table.tap_step_percent.values.astype(float)) / 100.
+        self.vm_delta_pu = table.tap_step_percent.values.astype(float) / 100. * .5 + tol
+        if vm_set_pu is not None:
+            vm_set_pu = np.broadcast_to(np.asarray(vm_set_pu, dtype=float), (n,))
+            vm_lower_pu = vm_set_pu - self.vm_delta_pu
+            vm_upper_pu = vm_set_pu + self.vm_delta_pu
+        self.vm_lower_pu = np.broadcast_to(np.asarray(vm_lower_pu, dtype=float), (n,)).copy()
+        self.vm_upper_pu = np.broadcast_to(np.asarray(vm_upper_pu, dtype=float), (n,)).copy()
+
+        # trafos controlling a slack bus are left alone, like a deactivated DiscreteTapControl
+        slack = net.ext_grid.loc[net.ext_grid.in_service, 'bus'].values
+        self.enabled = ~np.isin(self.controlled_bus, slack)
+        if not self.enabled.all():
+            logger.warning("Controlled Bus is Slack Bus - deactivating control of trafos %s"
+                           % list(self.tid[~self.enabled]))
+
+        self.tap_pos = table.tap_pos.values.astype(float)
+        self.init_pos = self.tap_pos.copy()
+        self.multi_step = multi_step
+        oscillation.reset(self)
+
+    @classmethod
+    def from_controllers(cls, net, trafotype="2W"):
+        """
+        Replaces the in service DiscreteTapControl of trafotype in net by one DiscreteTapControlGroup per level and order,
+        taking over their trafos, voltage bands, tap limits and initial tap positions.
+        Returns the list of groups.
+        """
+        objects = net.controller.object
+        idx = [i for i, ctrl in objects.items() if isinstance(ctrl, DiscreteTapControl) and
+               ctrl.trafotype == trafotype and net.controller.at[i, 'in_service']]
+        groups = []
+        for (level, order), members in net.controller.loc[idx].groupby(['level', 'order']).groups.items():
+            ctrls = list(objects.loc[members])
+            net.controller.drop(members, inplace=True)
+            group = cls(net, [ctrl.tid for ctrl in ctrls], [ctrl.vm_lower_pu for ctrl in ctrls],
+                        [ctrl.vm_upper_pu for ctrl in ctrls], trafotype=trafotype, level=level, order=order)
+            group.controlled_bus = np.array([ctrl.controlled_bus for ctrl in ctrls])
+            group.tap_min = np.array([ctrl.tap_min for ctrl in ctrls], dtype=float)
+            group.tap_max = np.array([ctrl.tap_max for ctrl in ctrls], dtype=float)
+            group.tap_direction = np.array([ctrl.tap_side_coeff * ctrl.tap_sign for ctrl in ctrls])
+            group.init_pos = np.array([ctrl.init_pos for ctrl in ctrls], dtype=float)
+            group.enabled = np.ones(len(ctrls), dtype=bool)
+            group.multi_step = all(getattr(ctrl, 'multi_step', False) for ctrl in ctrls)
+            groups.append(group)
+        return groups
+
+    def _state(self, net):
+        """
+        Reads the tap positions and the voltages at the controlled buses from net.
+        Returns vm_pu and the mask of trafos that are in net, in service and not frozen
+        """
+        table = net[self.trafotable]
+        pos = table.index.get_indexer(self.tid)
+        active = self.enabled & (pos >= 0)
+        active[active] = table.in_service.values[pos[active]].astype(bool)
+        self.tap_pos[pos >= 0] = table.tap_pos.values[pos[pos >= 0]]
+        vm_pu = np.full(len(self.tid), np.nan)
+        vm_pu[active] = net.res_bus.vm_pu.values[net.res_bus.index.get_indexer(self.controlled_bus[active])]
+        active &= ~oscillation.frozen(self)
+        return vm_pu, active
+
+    def _converged(self, vm_pu, active):
+        """
+        Mask of the trafos inside their voltage band, at the tap limit in the needed direction, or not active
+        """
+        low = vm_pu < self.vm_lower_pu
+        high = vm_pu > self.vm_upper_pu
+        at_min = self.tap_pos == self.tap_min
+        at_max = self.tap_pos == self.tap_max
+        up = self.tap_direction == 1
+        down = self.tap_direction == -1
+        stuck = up & ((low & at_min) | (high & at_max)) | down & ((low & at_max) | (high & at_min))
+        in_band = (self.vm_lower_pu < vm_pu) & (vm_pu < self.vm_upper_pu)
+        return ~active | stuck | in_band
+
+    def tap_steps(self, vm_pu):
+        """
+        Number of tap positions to step per trafo. One, or with multi_step the fewest positions that bring vm_pu into
+        the band when each position changes the voltage by tap_step_percent
+        """
+        # controllers loaded with pp.from_json from nets saved before multi_step have no multi_step
+        if not getattr(self, 'multi_step', False):
+            return np.ones(len(self.tid))
+        deviation = np.maximum(self.vm_lower_pu - vm_pu, vm_pu - self.vm_upper_pu)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n = np.ceil(deviation / (self.tap_step_pu * vm_pu))
+        n[~np.isfinite(n)] = 1
+        return np.maximum(n, 1)
+
+    def control_step(self, net):
+        """
+        Implements one step of the Discrete controller for all trafos, stepping one tap position up or down,
+        or with multi_step as many positions as estimated by tap_steps within the tap limits
+        """
+        vm_pu, active = self._state(net)
+        low = active & (vm_pu < self.vm_lower_pu)
+        high = active & ~low & (vm_pu > self.vm_upper_pu)
+        up = self.tap_direction == 1
+        down = self.tap_direction == -1
+        step = np.zeros(len(self.tid))
+        step[up & low & (self.tap_pos > self.tap_min)] = -1
+        step[up & high & (self.tap_pos < self.tap_max)] = 1
+        step[down & low & (self.tap_pos < self.tap_max)] = 1
+        step[down & high & (self.tap_pos > self.tap_min)] = -1
+
+        changed = step != 0
+        oscillation.step(self, step)
+        tap_pos = self.tap_pos + step * self.tap_steps(vm_pu)
+        self.tap_pos[changed] = np.clip(tap_pos, self.tap_min, self.tap_max)[changed]
+        # WRITE TO NET
+        if changed.any():
+            net[self.trafotable].loc[self.tid[changed], "tap_pos"] = self.tap_pos[changed]
+
+    def is_converged(self, net):
+        """
+        Checks if the voltages of all trafos are within their voltage band or their tap limit is reached
+        """
+        vm_pu, active = self._state(net)
+        converged = self._converged(vm_pu, active)
+        oscillating = np.zeros(len(self.tid), dtype=bool)
+        if oscillation.damping.taps:
+            oscillating = oscillation.oscillating(self) & ~converged
+            oscillation.freeze(self, oscillating)
+        return bool((converged | oscillating).all())
+
+    def initialize_control(self, net):
+        oscillation.reset(self)
+
+    def restore_init_state(self, net):
+        self.tap_pos = self.init_pos.copy()
+        oscillation.reset(self)
+        net[self.trafotable].loc[self.tid, "tap_pos"] = self.tap_pos
+
+    def __repr__(self):
+        return '%s of %d %s' % (self.__class__.__name__, len(self.tid), self.trafotable)
+
+    def __str__(self):
+        return self.__repr__()
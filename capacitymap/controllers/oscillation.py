@@ -0,0 +1,143 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+"""
+Oscillation detection of discrete controllers. The state of a controller is the direction of its last step and the
+number of reversals of the step direction in the current control loop, kept on the controller as osc_direction,
+osc_reversals and osc_frozen: plain ints and bools for a single controller and lists for the elements of a group
+controller, so that the controllers stay serializable with pp.to_json. Controllers without the state, e.g. loaded
+with pp.from_json from a net saved before, get it on first use.
+"""
+
+import numpy as np
+
+# Reversals of the step direction that count as oscillation, 2 for up, down, up
+MAX_REVERSALS = 2
+
+
+def _size(ctrl):
+    """
+    Number of controlled elements of a group controller, None for a single controller
+    """
+    tid = getattr(ctrl, 'tid', None)
+    return len(tid) if np.ndim(tid) else None
+
+
+def reset(ctrl):
+    """
+    Starts a new control loop for ctrl
+    """
+    n = _size(ctrl)
+    if n is None:
+        ctrl.osc_direction, ctrl.osc_reversals, ctrl.osc_frozen = 0, 0, False
+    else:
+        ctrl.osc_direction, ctrl.osc_reversals, ctrl.osc_frozen = [0] * n, [0] * n, [False] * n
+
+
+def _state(ctrl):
+    if not hasattr(ctrl, 'osc_frozen'):
+        reset(ctrl)
+    return np.array(ctrl.osc_direction), np.array(ctrl.osc_reversals), np.array(ctrl.osc_frozen, dtype=bool)
+
+
+def _store(ctrl, direction, reversals, frozen):
+    ctrl.osc_direction, ctrl.osc_reversals, ctrl.osc_frozen = direction.tolist(), reversals.tolist(), frozen.tolist()
+
+
+def step(ctrl, direction):
+    """
+    Records the direction of a step of ctrl, +1, -1 or 0 for no step, per element for a group controller
+    """
+    last, reversals, frozen = _state(ctrl)
+    direction = np.sign(direction).astype(int)
+    moved = direction != 0
+    reversals = reversals + (moved & (last != 0) & (direction != last))
+    _store(ctrl, np.where(moved, direction, last), reversals, frozen)
+
+
+def frozen(ctrl):
+    """
+    True where ctrl is kept at its position for the rest of the control loop
+    """
+    return _state(ctrl)[2]
+
+
+def oscillating(ctrl):
+    """
+    True where ctrl oscillates and is not frozen yet
+    """
+    _, reversals, frozen = _state(ctrl)
+    return (reversals >= MAX_REVERSALS) & ~frozen
+
+
+def freeze(ctrl, mask=True):
+    """
+    Keeps ctrl, or its elements in mask, at the current position for the rest of the control loop
+    """
+    last, reversals, frozen = _state(ctrl)
+    _store(ctrl, last, reversals, frozen | mask)
+
+
+def restart(ctrl):
+    """
+    Forgets the reversals of ctrl so far, it continues stepping
+    """
+    last, reversals, frozen = _state(ctrl)
+    _store(ctrl, np.zeros_like(last), np.zeros_like(reversals), frozen)
+
+
+class OscillationDamping:
+    """
+    Damping of the discrete controllers that oscillate in a control loop, shared by all controllers.
+
+    INPUT
+        mode (str) - 'freeze': an oscillating controller keeps its current position and is converged.
+                     'order': of the oscillating controllers only the one first in level and order of net.controller
+                     continues stepping, the others are frozen. It is frozen when it oscillates again.
+                     Elements of a group controller are always frozen.
+        taps (bool) - Also damp tap changers. By default only shunts are damped and oscillating tap changers
+                      step until run_control reaches its iteration limit, as before oscillation detection.
+    """
+
+    def __init__(self, mode='freeze', taps=False):
+        self.mode = mode
+        self.taps = taps
+        self.reset()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, value):
+        if value not in ('freeze', 'order'):
+            raise UserWarning("Damping mode %s is not supported, use 'freeze' or 'order'" % value)
+        self._mode = value
+
+    def reset(self):
+        """
+        Starts a new control loop
+        """
+        self.leader = None
+        self.continued = set()
+
+    def damp(self, net, ctrl):
+        """
+        Damps ctrl, which oscillates. Returns True if it is frozen, False if it continues stepping
+        """
+        if self.mode == 'freeze':
+            freeze(ctrl)
+            return True
+        key = (tuple(np.atleast_1d(net.controller.at[ctrl.index, 'level'])), net.controller.at[ctrl.index, 'order'],
+               ctrl.index)
+        if key in self.continued or (self.leader is not None and self.leader < key):
+            freeze(ctrl)
+            return True
+        self.leader = key
+        self.continued.add(key)
+        restart(ctrl)
+        return False
+
+
+# Damping of all discrete controllers, set damping.mode or damping.taps to change it
+damping = OscillationDamping()
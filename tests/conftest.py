@@ -0,0 +1,16 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+import os
+import pytest
+import pandapower as pp
+
+DATA = os.path.join(os.path.dirname(__file__), os.pardir, 'tutorials', 'data', 'svedala')
+
+
+@pytest.fixture
+def svedala():
+    """
+    Svedala net of the tutorials, with tap and shunt controllers saved by pp.to_json
+    """
+    return pp.from_json(os.path.join(DATA, 'svedala.json'))
@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+import pandapower as pp
+from capacitymap.analysis import analysis_check
+
+
+def radial_net():
+    """
+    20 kV feeder 0 - 1 - 2 - 3 from the ext_grid at bus 0, a load at bus 1 and an out of service load at bus 3
+    """
+    net = pp.create_empty_network()
+    buses = [pp.create_bus(net, vn_kv=20.) for _ in range(4)]
+    pp.create_ext_grid(net, buses[0])
+    for from_bus, to_bus in [(0, 1), (1, 2), (2, 3)]:
+        pp.create_line(net, buses[from_bus], buses[to_bus], length_km=2., std_type="NA2XS2Y 1x95 RM/25 12/20 kV")
+    pp.create_load(net, buses[1], p_mw=1.)
+    pp.create_load(net, buses[3], p_mw=1., in_service=False)
+    return net
+
+
+def test_contingency_results_ignore_loads_out_of_service():
+    net = radial_net()
+    scenario = [[1, 2], []]
+    critical = analysis_check.contingency_test(net, contingency_scenario=scenario)
+    lines, trafos, _ = analysis_check.contingency_test(net, contingency_scenario=scenario, results=True)
+    assert (lines, trafos) == critical == ([], [])
+
+
+def test_ladder_rungs_counted():
+    net = radial_net()
+    analysis_check.reset_counters()
+    analysis_check.check_violations(net)
+    counters = analysis_check.get_counters()
+    assert counters['counter'] == counters['power_flows'] == 1
+    ladder = analysis_check.SolverLadder()
+    assert len(ladder.attempts('auto')) == 1 + len(analysis_check.LADDER_RUNGS) - 1
+    ladder.retry = False
+    assert ladder.attempts('auto') == [('start', {'init': 'auto'})]
+
+
+def test_no_margins_unless_asked(monkeypatch):
+    def margins(*args, **kwargs):
+        raise AssertionError('margins computed')
+    monkeypatch.setattr(analysis_check, 'violation_margins', margins)
+    net = radial_net()
+    feasible, tested = analysis_check.simple_contingency_test(net, contingency_scenario=[[1, 2], []])
+    assert feasible and tested == 2
@@ -0,0 +1,90 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+import numpy as np
+import pandapower as pp
+import pytest
+from capacitymap.analysis import analysis_check, capacity_analysis
+from capacitymap.analysis.headroom_cache import HeadroomCache
+
+
+def meshed_net():
+    """
+    20 kV net with a loop of bus 1, 2 and 3 behind the ext_grid at bus 0 and a load at bus 2
+    """
+    net = pp.create_empty_network()
+    buses = [pp.create_bus(net, vn_kv=20.) for _ in range(4)]
+    pp.create_ext_grid(net, buses[0])
+    for from_bus, to_bus in [(0, 1), (1, 2), (2, 3), (1, 3)]:
+        pp.create_line(net, buses[from_bus], buses[to_bus], length_km=2., std_type="NA2XS2Y 1x95 RM/25 12/20 kV")
+    pp.create_load(net, buses[2], p_mw=1.)
+    return net
+
+
+def radial_net():
+    """
+    20 kV net with the feeder 0 - 1 - 2 - 3 from the ext_grid at bus 0, a branch 1 - 4 and a load at bus 3
+    """
+    net = pp.create_empty_network()
+    buses = [pp.create_bus(net, vn_kv=20.) for _ in range(5)]
+    pp.create_ext_grid(net, buses[0])
+    for from_bus, to_bus in [(0, 1), (1, 2), (2, 3), (1, 4)]:
+        pp.create_line(net, buses[from_bus], buses[to_bus], length_km=2., std_type="NA2XS2Y 1x95 RM/25 12/20 kV")
+    pp.create_load(net, buses[3], p_mw=1.)
+    return net
+
+
+def test_prune_keeps_islanding_outages():
+    # the outage of line 2 islands the load at bus 3 and fails for a probe at any bus
+    net = radial_net()
+    scenario = [[0, 1, 2, 3], []]
+    full = capacity_analysis.headroom(net, 'sgen', 20., contingency_scenario=scenario, progress=None)
+    pruned = capacity_analysis.headroom(net, 'sgen', 20., contingency_scenario=scenario, progress=None,
+                                        prune=0.01, validate=True)
+    assert np.allclose(pruned['Headroom'].values.astype(float), full['Headroom'].values.astype(float))
+    assert not capacity_analysis.iter_headroom.pruning_errors
+
+
+@pytest.mark.parametrize('islanding', [True, False])
+def test_both_equals_single_runs(islanding):
+    net = meshed_net()
+    scenario = [[1, 2, 3], []]
+    both = capacity_analysis.headroom(net, 'both', 20., contingency_scenario=scenario, progress=None,
+                                      islanding=islanding)
+    for loadorgen in ['load', 'sgen']:
+        single = capacity_analysis.headroom(net, loadorgen, 20., contingency_scenario=scenario, progress=None,
+                                            islanding=islanding)
+        assert np.allclose(both['Headroom ' + loadorgen].values.astype(float),
+                           single['Headroom'].values.astype(float))
+
+
+def test_affected_buses_binding():
+    net = meshed_net()
+    changes = {'line': [2]}
+    assert capacity_analysis.affected_buses(net, changes, depth=0) == [2, 3]
+    binding = {1: {'line': {2}}, 0: {'trafo': {2}}}
+    assert capacity_analysis.affected_buses(net, changes, depth=0, binding=binding) == [1, 2, 3]
+
+
+@pytest.mark.parametrize('method', ['regula_falsi', 'illinois'])
+def test_margin_methods_save_power_flows(method):
+    power_flows = {}
+    for m in ['bisection', method]:
+        net = meshed_net()
+        analysis_check.reset_counters()
+        capacity_analysis.max_cap(net, 3, 'load', 20., 0., 0., 0.1, None, None, [[], []], method=m)
+        power_flows[m] = analysis_check.get_counters()['counter']
+    assert power_flows[method] < power_flows['bisection']
+
+
+def test_cache_keyed_by_guess(tmp_path):
+    cache = HeadroomCache(str(tmp_path))
+    net = meshed_net()
+    args = (net, 3, 'load', 20., 0., 0., 1., None, None, [[], []])
+    head = capacity_analysis.max_cap(*args, guess=5., cache=cache)
+    analysis_check.reset_counters()
+    assert capacity_analysis.max_cap(*args, guess=5., cache=cache) == head
+    assert analysis_check.get_counters()['counter'] == 0
+    # another guess probes other points and is searched again
+    capacity_analysis.max_cap(*args, guess=8., cache=cache)
+    assert analysis_check.get_counters()['counter'] > 0
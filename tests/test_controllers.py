@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+import pandapower as pp
+from capacitymap.analysis import analysis_check
+from capacitymap.controllers import oscillation
+from capacitymap.controllers.controller_functions import set_multi_step, reset_all_controllers
+from capacitymap.controllers.discrete_trafo_controller import DiscreteTapControl
+from capacitymap.controllers.discrete_trafo_group_controller import DiscreteTapControlGroup
+
+
+def test_saved_controllers_run(svedala):
+    # svedala.json was saved before multi_step existed
+    assert not any(hasattr(ctrl, 'multi_step') for ctrl in svedala.controller.object.values)
+    check, _ = analysis_check.check_violations(svedala, run_control=True)
+    assert not check[6]
+
+
+def test_saved_controllers_multi_step(svedala):
+    set_multi_step(svedala)
+    check, _ = analysis_check.check_violations(svedala, run_control=True)
+    assert not check[6]
+
+
+def test_controllers_json_roundtrip(svedala):
+    # the reset gives every controller its oscillation state, the control loop only the ones in service
+    reset_all_controllers(svedala)
+    analysis_check.check_violations(svedala, run_control=True)
+    assert all(hasattr(ctrl, 'osc_frozen') for ctrl in svedala.controller.object.values)
+    net = pp.from_json_string(pp.to_json(svedala))
+    for ctrl, loaded in zip(svedala.controller.object.values, net.controller.object.values):
+        assert (loaded.osc_direction, loaded.osc_reversals, loaded.osc_frozen) == \
+               (ctrl.osc_direction, ctrl.osc_reversals, ctrl.osc_frozen)
+    reset_all_controllers(net)
+    check, _ = analysis_check.check_violations(net, run_control=True)
+    assert not check[6]
+
+
+def test_saved_controllers_reset(svedala):
+    # svedala.json was saved before oscillation detection existed
+    assert not any(hasattr(ctrl, 'osc_frozen') for ctrl in svedala.controller.object.values)
+    reset_all_controllers(svedala)
+    assert all(not ctrl.osc_frozen for ctrl in svedala.controller.object.values)
+
+
+def test_reset_after_controllers_change(svedala):
+    reset_all_controllers(svedala)
+    # an edited initial position is picked up by the next reset
+    ctrl = next(c for c in svedala.controller.object.values if isinstance(c, DiscreteTapControl))
+    ctrl.init_pos = ctrl.tap_min
+    reset_all_controllers(svedala)
+    assert svedala.trafo.at[ctrl.tid, 'tap_pos'] == ctrl.tap_min
+    # controllers replaced in the same table are restored from their own initial state
+    groups = DiscreteTapControlGroup.from_controllers(svedala)
+    svedala.trafo.tap_pos += 1
+    reset_all_controllers(svedala)
+    for group in groups:
+        assert (svedala.trafo.loc[group.tid, 'tap_pos'].values == group.init_pos).all()
+    # another net is not reset with the state of the first
+    other = svedala.deepcopy()
+    for group in groups:
+        group.init_pos = group.init_pos + 1
+    reset_all_controllers(other)
+    for group in other.controller.object.values:
+        if isinstance(group, DiscreteTapControlGroup):
+            assert (other.trafo.loc[group.tid, 'tap_pos'].values == group.init_pos).all()
+
+
+def test_taps_not_damped_by_default():
+    assert not oscillation.damping.taps
+    assert oscillation.damping.mode == 'freeze'
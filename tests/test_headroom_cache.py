@@ -0,0 +1,18 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright Contributors to Grid Capacity Map
+
+from capacitymap.analysis.headroom_cache import HeadroomCache
+
+
+def test_get_bus_upper_lim_p(tmp_path):
+    cache = HeadroomCache(str(tmp_path))
+    cache.put_bus('study', 1, 12., 20.)
+    cache.put_bus('study', 2, 20., 20.)
+    # a headroom below the searched upper limit holds for any upper limit above it
+    assert cache.get_bus('study', 1, 20.) == 12.
+    assert cache.get_bus('study', 1, 30.) == 12.
+    assert cache.get_bus('study', 1, 10.) is None
+    # the full upper limit only holds for the same upper limit
+    assert cache.get_bus('study', 2, 20.) == 20.
+    assert cache.get_bus('study', 2, 10.) is None
+    assert cache.get_bus('study', 2, 30.) is None